@@ -0,0 +1,50 @@
+#!/bin/env python3
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from iglib import flowerscript  # noqa: E402
+
+
+class LegacyAssembler(flowerscript.Assembler):
+    # the previous label lookup: every attribute access is intercepted and
+    # every s.label_xxx builds a new Label
+    def __getattribute__(self, name):
+        if name.startswith('label_'):
+            return flowerscript.Label(self, name)
+        return object.__getattribute__(self, name)
+
+
+def assemble(cls, count):
+    s = cls(encoding='cp932')
+    for i in range(count):
+        if i % 8 == 0:
+            getattr(s, 'label_%d' % (i // 8)).define()
+        s.op('dlg_str', 0x00, 'テキスト%d' % i)
+        s.op('wait_click', 0x01)
+        s.op('jmp_eq', [0, 0], 0x64, [0, 0], i, getattr(s, 'label_%d' % (i // 8)))
+        s.op('val_add', 0x64, 1)
+    s.finish()
+    return s
+
+
+def measure(cls, count):
+    beg = time.perf_counter()
+    s = assemble(cls, count)
+    return s, time.perf_counter() - beg
+
+
+def main(count=30000):
+    old, old_time = measure(LegacyAssembler, count)
+    new, new_time = measure(flowerscript.Assembler, count)
+    if old.bytes != new.bytes:
+        raise AssertionError('assembled bytes differ')
+    ops = count * 4
+    for name, elapsed in (('legacy', old_time), ('current', new_time)):
+        print('%-8s %8.3f s %8.2f us/op' % (name, elapsed, elapsed / ops * 1e6))
+    print('speedup: %.2fx' % (old_time / new_time))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:2]))
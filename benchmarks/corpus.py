@@ -0,0 +1,132 @@
+#!/bin/env python3
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from iglib import flowerscript  # noqa: E402
+from iglib.flowerscript import OPS, OPS_BYNAME, Instruction, Type  # noqa: E402
+
+# relative frequency by op name, roughly that of the FLOWERS scripts;
+# every other op gets OTHER_WEIGHT so that all of OPS is exercised
+WEIGHTS = {
+    'dlg_str': 30, 'wait_click': 18, 'v_play': 12, 'dlg_num': 6,
+    'add_backlog': 3, 'fg_12': 3, 'wait': 3, 'bg_0f': 2, 'fg_metrics': 2,
+    'fg_clear': 2, 'crossfade': 2, 'se_play': 2, 'val_add': 2, 'jmp_eq': 2,
+    'bgm_play': 1, 'jmp': 1, 'val_set': 1, 'fg_avatar': 1,
+}
+OTHER_WEIGHT = 0.2
+SELECT_WEIGHT = 1  # sel_beg, 2-3 x sel_add, sel_end
+
+TEXT = {
+    'cp932': 'あいうえおかきくけこさしすせそたちつてとなにぬねのはひふへほ'
+             'まみむめもやゆよらりるれろわをんアイウエオカキクケコサシスセソ'
+             '最初見る朗読劇発表会離別学園寮百合花先輩後輩「」、。…！？',
+    'gbk': '的一是不了在人有我他这个们中来上大为和国地到以说时要就出会可'
+           '也你对生能而子那得于着下自之年过发后作里用道行所然家种事成方'
+           '百合花学园宿舍前辈后辈「」，。…！？',
+}
+# op name: file name pattern
+FILES = {
+    'bg_0f': 'bg%03d.png', 'bg_10': 'bg%03d.png', 'fg_12': 'fg%03d_%02d.png',
+    'fg_9c': 'fg%03d_%02d.png', 'fg_avatar': 'face%03d_%02d.png',
+    'bgm_play': 'bgm%02d', 'bgm_fadein': 'bgm%02d', 'se_play': 'se%03d',
+    'se_fadein': 'se%03d', 'v_play': 'v%03d_%04d', 'jmp_script': '%02da_%05d.s',
+}
+
+
+def _text(rnd, encoding):
+    chars = TEXT[encoding]
+    return ''.join(rnd.choice(chars) for _ in range(rnd.randrange(8, 64)))
+
+
+def _string(rnd, opname, encoding):
+    if opname in FILES:
+        pattern = FILES[opname]
+        return pattern % tuple(
+            rnd.randrange(100) for _ in range(pattern.count('%')))
+    return _text(rnd, encoding)
+
+
+def _args(rnd, op, index, count, encoding):
+    args = []
+    for size, tp in op.fields:
+        if tp == Type.HEXNUM:
+            args.append(rnd.choice((0, 0, 0, 1, 2, 0x64, 0x65, 0x6c)))
+        elif tp == Type.SG_DEC:
+            args.append(rnd.randrange(-100, 1000 if size > 1 else 100))
+        elif tp == Type.UN_DEC:
+            args.append(rnd.randrange(min(1000, 1 << (size * 8))))
+        elif tp == Type.OFFSET:
+            # mostly forward, near by jumps
+            args.append(min(count - 1, max(0, index + rnd.randrange(-20, 60))))
+        elif tp == Type.BARRAY:
+            args.append(bytes(size))
+    return args
+
+
+def make_records(rnd, count, encoding):
+    # Instruction records with offset = index, OFFSET fields point to
+    # indices, Assembler.from_records turns them into real offsets
+    opcodes = list(OPS)
+    weights = [WEIGHTS.get(OPS[x].opname, OTHER_WEIGHT) for x in opcodes]
+    opcodes.append(None)
+    weights.append(SELECT_WEIGHT)
+    records = []
+    while len(records) < count:
+        opcode = rnd.choices(opcodes, weights)[0]
+        if opcode == None:
+            group = [(OPS_BYNAME['sel_beg'][0], [0])]
+            group += [(OPS_BYNAME['sel_add'][0], [0])
+                      for _ in range(rnd.randrange(2, 4))]
+            group.append((OPS_BYNAME['sel_end'][0], [0x64]))
+        else:
+            group = [(opcode, None)]
+        for opcode, args in group:
+            op = OPS[opcode]
+            opname = op.opname
+            index = len(records)
+            if opname == 'sel_add':
+                args = [min(count - 1, index + rnd.randrange(2, 40))]
+            elif args == None:
+                args = _args(rnd, op, index, count, encoding)
+            string = tail = None
+            if op.slen_index != None:
+                string = _string(rnd, opname, encoding)
+                if opname == 'dlg_str' and rnd.random() < 0.05:
+                    tail = b'\0'
+            records.append(Instruction(index, opcode, args, string, tail))
+    del records[count:]
+    for ins in records:
+        # targets cut off by the trim above
+        ins.args = [min(x, count - 1) if tp == Type.OFFSET else x
+                    for x, tp in zip(ins.args, ins.op.kinds)]
+    return records
+
+
+def make_script(seed, count, encoding='cp932'):
+    rnd = random.Random(seed)
+    records = make_records(rnd, count, encoding)
+    return bytes(flowerscript.Assembler.from_records(records, encoding).bytes)
+
+
+def make_corpus(scale=1, scripts=20, seed=0):
+    # (name, encoding, data); scale multiplies the number of scripts, every
+    # third script uses gbk like a chinese translation
+    result = []
+    rnd = random.Random(seed)
+    for i in range(scripts * scale):
+        encoding = 'gbk' if i % 3 == 2 else 'cp932'
+        count = rnd.randrange(200, 1200)
+        result.append(('%02da_%05d.s' % (i % 4, i), encoding,
+                       make_script(rnd.random(), count, encoding)))
+    return result
+
+
+if __name__ == '__main__':
+    # write a corpus to a directory: corpus.py OUT [SCALE]
+    out = sys.argv[1]
+    os.makedirs(out, exist_ok=True)
+    for name, encoding, data in make_corpus(*map(int, sys.argv[2:3])):
+        with open(os.path.join(out, name), 'wb') as fp:
+            fp.write(data)
@@ -0,0 +1,175 @@
+#!/bin/env python3
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from iglib import flowerscript, igarchive  # noqa: E402
+
+import corpus  # noqa: E402
+
+
+def best_of(repeat, func, *args):
+    best = None
+    for _ in range(repeat):
+        beg = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - beg
+        best = elapsed if best == None else min(best, elapsed)
+    return best
+
+
+def stage_decode(scripts):
+    for _, encoding, data in scripts:
+        flowerscript.decode(data, encoding)
+
+
+def stage_format(decoded):
+    for instructions, targets in decoded:
+        list(flowerscript.place_labels(instructions, targets))
+
+
+def stage_disasm(scripts):
+    for _, encoding, data in scripts:
+        flowerscript.disasm(data, encoding)
+
+
+def stage_iter_disasm(scripts):
+    for _, encoding, data in scripts:
+        for _ in flowerscript.iter_disasm(data, encoding):
+            pass
+
+
+def stage_assemble(decoded):
+    for instructions, encoding in decoded:
+        flowerscript.Assembler.from_records(instructions, encoding)
+
+
+def stage_asm_op(compiled):
+    # the disasm text run as iglib asm does, one Assembler.op per line;
+    # compiled beforehand so that only the assembler is timed
+    for code, encoding in compiled:
+        s = flowerscript.Assembler(encoding)
+        exec(code, {'s': s})
+        s.finish()
+
+
+def stage_pack(scripts, path):
+    with open(path, 'wb') as fp:
+        igarchive.IgaWriter(fp, 0xFF).write(
+            (name, data) for name, _, data in scripts)
+
+
+def stage_create(scripts):
+    igarchive.iga_create([(name, data) for name, _, data in scripts], 0xFF)
+
+
+def stage_unpack(path):
+    with igarchive.IgaArchive(path, 0xFF) as arc:
+        for name in arc:
+            arc.read(name)
+
+
+def run_scale(scale, repeat, tmpdir):
+    scripts = corpus.make_corpus(scale)
+    size = sum(len(data) for _, _, data in scripts)
+    decoded = [
+        (flowerscript.decode(data, encoding), encoding)
+        for _, encoding, data in scripts
+    ]
+    count = sum(len(instructions) for instructions, _ in decoded)
+    labeled = [
+        (instructions, {x for ins in instructions for x in ins.targets()})
+        for instructions, _ in decoded
+    ]
+    compiled = [
+        (compile('\n'.join(flowerscript.disasm(data, encoding)), name,
+                 'exec'), encoding)
+        for name, encoding, data in scripts
+    ]
+    path = os.path.join(tmpdir, 'bench_%d.iga' % scale)
+    stage_pack(scripts, path)
+    results = []
+    for stage, func, args in (
+        ('decode', stage_decode, (scripts,)),
+        ('format', stage_format, (labeled,)),
+        ('disasm', stage_disasm, (scripts,)),
+        ('iter_disasm', stage_iter_disasm, (scripts,)),
+        ('assemble', stage_assemble, (decoded,)),
+        ('asm_op', stage_asm_op, (compiled,)),
+        ('pack', stage_pack, (scripts, path)),
+        ('create', stage_create, (scripts,)),
+        ('unpack', stage_unpack, (path,)),
+    ):
+        seconds = best_of(repeat, func, *args)
+        results.append({
+            'stage': stage,
+            'scale': scale,
+            'scripts': len(scripts),
+            'instructions': count,
+            'bytes': size,
+            'seconds': seconds,
+            'mb_per_s': size / 0x100000 / seconds,
+        })
+        print('%-11s %4dx %6d scripts %8d ins %8.3f s %8.1f MB/s' % (
+            stage, scale, len(scripts), count, seconds,
+            results[-1]['mb_per_s']))
+    return results
+
+
+def commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True,
+            text=True, cwd=os.path.dirname(__file__) or '.',
+        ).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(old, new):
+    # prints new / old throughput per stage and scale
+    old = {(r['stage'], r['scale']): r for r in old['results']}
+    print('stage       scale    old MB/s   new MB/s  ratio')
+    for r in new['results']:
+        key = (r['stage'], r['scale'])
+        if key in old:
+            print('%-11s %4dx %11.1f %10.1f  %.2fx' % (
+                r['stage'], r['scale'], old[key]['mb_per_s'], r['mb_per_s'],
+                r['mb_per_s'] / old[key]['mb_per_s']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='iglib benchmark suite')
+    parser.add_argument('--scales', default='1,10,100',
+                        help='comma separated corpus scales (default: 1,10,100)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('-o', '--output', default=None,
+                        help='write results as JSON')
+    parser.add_argument('--compare', default=None, metavar='JSON',
+                        help='results of an earlier run to compare with')
+    args = parser.parse_args()
+    report = {
+        'commit': commit(),
+        'python': platform.python_version(),
+        'numpy': igarchive.numpy != None,
+        'results': [],
+    }
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for scale in map(int, args.scales.split(',')):
+            report['results'] += run_scale(scale, args.repeat, tmpdir)
+    if args.output != None:
+        with open(args.output, 'w') as fp:
+            json.dump(report, fp, indent=1)
+    if args.compare != None:
+        with open(args.compare) as fp:
+            compare(json.load(fp), report)
+
+
+if __name__ == '__main__':
+    main()
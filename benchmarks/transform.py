@@ -0,0 +1,47 @@
+#!/bin/env python3
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from iglib import igarchive  # noqa: E402
+
+
+def ig_transform_data_bytewise(data, xor=0x00):
+    # the original per-byte implementation, kept as a baseline
+    return bytearray(
+        (data[i] ^ (i + 2) ^ xor) & 0xFF
+        for i in range(len(data))
+    )
+
+
+def measure(func, data, xor):
+    beg = time.perf_counter()
+    result = func(data, xor)
+    return result, time.perf_counter() - beg
+
+
+def main(size_mb=16):
+    data = os.urandom(int(size_mb * 0x100000))
+    backend = 'numpy' if igarchive.numpy is not None else 'int.from_bytes'
+    print('payload: %.1f MB, backend: %s' % (size_mb, backend))
+    old, old_time = measure(ig_transform_data_bytewise, data, 0xFF)
+    new, new_time = measure(igarchive.ig_transform_data, data, 0xFF)
+    if old != new:
+        raise AssertionError('transform results differ')
+    out = bytearray(len(data))
+    beg = time.perf_counter()
+    igarchive.ig_transform_into(data, out, 0xFF)
+    into_time = time.perf_counter() - beg
+    for name, elapsed in (
+        ('bytewise', old_time),
+        ('ig_transform_data', new_time),
+        ('ig_transform_into', into_time),
+    ):
+        print('%-18s %8.3f s %10.1f MB/s' %
+              (name, elapsed, size_mb / elapsed))
+    print('speedup: %.1fx' % (old_time / new_time))
+
+
+if __name__ == '__main__':
+    main(*map(float, sys.argv[1:2]))
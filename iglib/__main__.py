@@ -0,0 +1,189 @@
+#!/bin/env python3
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+from . import batch, flowerscript, igarchive, manifest
+
+
+def report(name, seconds, result, error):
+    if error != None:
+        print('%9.2f ms  %s  FAILED %s' % (seconds * 1e3, name, error))
+    elif result[1]:
+        print('%9.2f ms  %s  (cached)' % (seconds * 1e3, name))
+    else:
+        print('%9.2f ms  %s' % (seconds * 1e3, name))
+
+
+def summary(results, elapsed):
+    failed = sum(1 for *_, error in results if error != None)
+    cached = sum(1 for *_, res, error in results if error == None and res[1])
+    cpu = sum(seconds for _, seconds, _, _ in results)
+    print('%d files, %d cached, %d failed, %.2f s wall, %.2f s in workers, '
+          '%.1f files/s' % (len(results), cached, failed, elapsed, cpu,
+                            len(results) / max(elapsed, 1e-9)))
+    return 1 if failed else 0
+
+
+def cmd_dis(args):
+    os.makedirs(args.out, exist_ok=True)
+    jobs = [
+        (batch.source_name(source), source, args.out, args.encoding,
+         args.cache, args.cache_size)
+        for source in batch.list_sources(args.src, args.xor)
+    ]
+    return batch.run(batch.dis_one, jobs, args.jobs, report)
+
+
+def cmd_asm(args):
+    paths = [
+        os.path.join(args.src, name) for name in sorted(os.listdir(args.src))
+        if name.endswith('.py')
+    ]
+    if not args.out.endswith('.iga'):
+        os.makedirs(args.out, exist_ok=True)
+        jobs = [
+            (os.path.basename(path), path, args.out, args.encoding,
+             args.cache, args.cache_size)
+            for path in paths
+        ]
+        return batch.run(batch.asm_one, jobs, args.jobs, report)
+    jobs = [
+        (os.path.basename(path), path, None, args.encoding,
+         args.cache, args.cache_size)
+        for path in paths
+    ]
+    results = batch.run(batch.asm_one, jobs, args.jobs, report)
+    if any(error != None for *_, error in results):
+        print('%s not written' % args.out)
+        return results
+    datas = {name: result[0] for name, _, result, _ in results}
+    # written next to the archive and renamed, an existing one is kept
+    # when writing fails
+    fd, tmp = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(args.out)), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            igarchive.IgaWriter(fp, args.xor).write(
+                (name[:-len('.py')], datas[name]) for name, *_ in jobs)
+        os.replace(tmp, args.out)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return results
+
+
+def cmd_verify(args):
+    jobs = [
+        (batch.source_name(source), source, args.encoding)
+        for source in batch.list_sources(args.src, args.xor)
+    ]
+    return batch.run(batch.verify_one, jobs, args.jobs, report)
+
+
+def cmd_stats(args):
+    jobs = [
+        (batch.source_name(source), source, args.encoding)
+        for source in batch.list_sources(args.src, args.xor)
+    ]
+    results = batch.run(batch.stats_one, jobs, args.jobs)
+    stats = flowerscript.Statistics()
+    for _, _, result, error in results:
+        if error == None:
+            stats.merge(result[0])
+    print('opcode  name                 count      bytes  str bytes   ms')
+    for opcode, opname, count, size, str_size, seconds in stats.rows():
+        print('  0x%02x  %-18s %7d %10d %10d %6.1f' % (
+            opcode, opname, count, size, str_size, seconds * 1e3))
+    return results
+
+
+def cmd_manifest(args):
+    game = args.game if args.game != None else \
+        os.path.dirname(os.path.abspath(args.src))
+    results = []
+    result = manifest.build_manifest(
+        args.src, manifest.game_assets(game), args.encoding, args.xor,
+        args.jobs, report=lambda *res: results.append(res))
+    missing, orphans = result.missing(), result.orphans()
+    print('kind     referenced     assets    missing   orphaned')
+    for kind in sorted(result.references.keys() | result.assets.keys()):
+        print('%-8s %10d %10s %10s %10s' % (
+            kind, len(result.references.get(kind, ())),
+            len(result.assets[kind]) if kind in result.assets else '-',
+            len(missing.get(kind, ())) if kind in result.assets else '-',
+            len(orphans.get(kind, ())) if kind in result.assets else '-'))
+    if args.output != None:
+        with open(args.output, 'w', encoding='utf-8') as fp:
+            result.save(fp)
+    return results
+
+
+def add_options(parser, default):
+    # accepted before and after the command, a command only overrides the
+    # value when given
+    parser.add_argument('-j', '--jobs', type=int,
+                        default=None if default else argparse.SUPPRESS,
+                        help='worker processes (default: cpu count)')
+    parser.add_argument('-e', '--encoding',
+                        default='cp932' if default else argparse.SUPPRESS,
+                        help='cp932, or gbk for chinese translated games')
+    parser.add_argument('--xor', type=lambda x: int(x, 0),
+                        default=0xFF if default else argparse.SUPPRESS,
+                        help='archive key, 0xFF for script.iga (default)')
+    parser.add_argument('--cache', metavar='DIR',
+                        default=None if default else argparse.SUPPRESS,
+                        help='reuse results of unchanged files from DIR')
+    parser.add_argument('--cache-size', type=lambda x: int(float(x) * 0x100000),
+                        default=256 << 20 if default else argparse.SUPPRESS,
+                        metavar='MB',
+                        help='cache size limit in MB (default: 256)')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='iglib', description='batch (dis)assembler for InnocentGrey scripts')
+    add_options(parser, True)
+    options = argparse.ArgumentParser(add_help=False)
+    add_options(options, False)
+    commands = parser.add_subparsers(dest='command', required=True)
+    dis = commands.add_parser(
+        'dis', help='disassemble .s files', parents=[options])
+    dis.add_argument('src', help='directory of .s files or an .iga archive')
+    dis.add_argument('out', help='directory for the .s.py files')
+    dis.set_defaults(func=cmd_dis)
+    asm = commands.add_parser(
+        'asm', help='assemble .s.py files', parents=[options])
+    asm.add_argument('src', help='directory of .s.py files')
+    asm.add_argument('out', help='directory for the .s files, or an .iga')
+    asm.set_defaults(func=cmd_asm)
+    verify = commands.add_parser(
+        'verify', help='check that decoding and assembling is lossless',
+        parents=[options])
+    verify.add_argument('src', help='directory of .s files or an .iga archive')
+    verify.set_defaults(func=cmd_verify)
+    stats = commands.add_parser(
+        'stats', help='opcode histogram over all scripts', parents=[options])
+    stats.add_argument('src', help='directory of .s files or an .iga archive')
+    stats.set_defaults(func=cmd_stats)
+    assets = commands.add_parser(
+        'manifest', help='referenced assets, missing and unused ones',
+        parents=[options])
+    assets.add_argument('src', help='directory of .s files or an .iga archive')
+    assets.add_argument('game', nargs='?', default=None,
+                        help='directory of the asset archives '
+                             '(default: the one of src)')
+    assets.add_argument('-o', '--output', default=None, metavar='JSON',
+                        help='write every reference, missing and orphaned '
+                             'asset to JSON')
+    assets.set_defaults(func=cmd_manifest)
+    args = parser.parse_args(argv)
+    beg = time.perf_counter()
+    results = args.func(args)
+    return summary(results, time.perf_counter() - beg)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
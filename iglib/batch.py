@@ -0,0 +1,157 @@
+#!/bin/env python3
+import concurrent.futures
+import functools
+import os
+import time
+
+from . import cache, flowerscript, igarchive
+
+
+_archives = {}  # (path, xor): (file identity, IgaArchive)
+
+
+def open_archive(path, xor):
+    # one mapping per archive and worker process, mapped again when the
+    # file was replaced or rewritten since, also in workers that inherited
+    # the mapping by fork
+    st = os.stat(path)
+    identity = st.st_dev, st.st_ino, st.st_mtime_ns, st.st_size
+    entry = _archives.get((path, xor))
+    if entry != None:
+        if entry[0] == identity:
+            return entry[1]
+        try:
+            entry[1].close()
+        except BufferError:
+            pass  # views of the old mapping are still in use
+    archive = igarchive.IgaArchive(path, xor)
+    _archives[path, xor] = identity, archive
+    return archive
+
+
+@functools.lru_cache(maxsize=None)
+def open_cache(directory, max_size):
+    return cache.Cache(directory, max_size) if directory != None else None
+
+
+def list_sources(src, xor=0xFF, suffix='.s'):
+    # src: a directory or an IGA archive, returns (archive, xor, name)
+    # sources, archive is None for plain files
+    if os.path.isdir(src):
+        return [
+            (None, xor, os.path.join(src, name))
+            for name in sorted(os.listdir(src)) if name.endswith(suffix)
+        ]
+    return [(src, xor, name) for name in open_archive(src, xor)]
+
+
+def archive_sources(archive, xor=0xFF):
+    # archive: an IgaArchive, or a path to an archive or a directory
+    if isinstance(archive, str):
+        return list_sources(archive, xor)
+    return [(archive.path, archive.xor, name) for name in archive]
+
+
+def source_name(source):
+    archive, _, name = source
+    return name if archive != None else os.path.basename(name)
+
+
+def read_source(source):
+    archive, xor, name = source
+    if archive == None:
+        with open(name, 'rb') as fp:
+            return fp.read()
+    return open_archive(archive, xor).read(name)
+
+
+def dis_one(source, out_dir, encoding, cache_dir=None, cache_size=0):
+    # returns (input size, whether the result came from the cache)
+    name = source_name(source)
+    data = read_source(source)
+    store = open_cache(cache_dir, cache_size)
+    text = key = None
+    if store != None:
+        key = store.key('dis', data, encoding)
+        text = store.get(key)
+    cached = text != None
+    if not cached:
+        lines = flowerscript.disasm(data, encoding)
+        text = ''.join(line + '\n' for line in lines).encode('utf-8')
+        if store != None:
+            store.put(key, text)
+    path = igarchive.iga_entry_path(out_dir, name + '.py')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as fp:
+        fp.write(text)
+    return len(data), cached
+
+
+def asm_source(text, encoding):
+    s = flowerscript.Assembler(encoding)
+    exec(text, {'s': s})
+    s.finish()
+    return s.bytes
+
+
+def asm_one(path, out_dir, encoding, cache_dir=None, cache_size=0):
+    # returns (output size, or the bytes when out_dir is None, whether the
+    # result came from the cache)
+    with open(path, 'rb') as fp:
+        text = fp.read()
+    store = open_cache(cache_dir, cache_size)
+    data = key = None
+    if store != None:
+        key = store.key('asm', text, encoding)
+        data = store.get(key)
+    cached = data != None
+    if not cached:
+        data = asm_source(text.decode('utf-8'), encoding)
+        if store != None:
+            store.put(key, data)
+    if out_dir == None:
+        return data, cached
+    name = os.path.basename(path)[:-len('.py')]
+    with open(os.path.join(out_dir, name), 'wb') as fp:
+        fp.write(data)
+    return len(data), cached
+
+
+def verify_one(source, encoding):
+    data = read_source(source)
+    diff = flowerscript.verify(data, encoding)
+    if diff != None:
+        offset, opcode = diff
+        raise ValueError('first difference at offset 0x%x%s' % (
+            offset, '' if opcode == None else ', opcode 0x%02x (%s)' % (
+                opcode, flowerscript.OPS[opcode].opname)))
+    return len(data), False
+
+
+def stats_one(source, encoding):
+    stats = flowerscript.Statistics()
+    for _ in flowerscript.iter_decode(read_source(source), encoding, stats):
+        pass
+    return stats, False
+
+
+def _timed(func, name, *args):
+    beg = time.perf_counter()
+    try:
+        result, error = func(*args), None
+    except Exception as e:
+        result, error = None, '%s: %s' % (type(e).__name__, e)
+    return name, time.perf_counter() - beg, result, error
+
+
+def run(func, jobs, workers=None, report=None):
+    # jobs: (name, *args) tuples for func(*args), run across processes;
+    # report(name, seconds, result, error) is called as each one finishes
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        futures = [executor.submit(_timed, func, *job) for job in jobs]
+        for future in concurrent.futures.as_completed(futures):
+            results.append(future.result())
+            if report != None:
+                report(*results[-1])
+    return results
@@ -0,0 +1,109 @@
+#!/bin/env python3
+import hashlib
+import os
+import tempfile
+
+from . import flowerscript
+
+# bump when the text format of disasm or the Assembler output changes
+FORMAT_VERSION = 1
+
+# the directory is rescanned after 1/RESCAN of max_size was written, other
+# processes sharing it can make it overshoot by that much each
+RESCAN = 8
+
+
+def ops_fingerprint():
+    desc = repr(sorted(
+        (opcode, op.opname, [(size, tp.value) for size, tp in op.fields])
+        for opcode, op in flowerscript.OPS.items()
+    ))
+    return hashlib.sha256(desc.encode()).hexdigest()[:16]
+
+
+OPS_FINGERPRINT = ops_fingerprint()
+
+
+class Cache:
+    # content addressed files under directory, shared between processes:
+    # entries are written to a temporary file and renamed into place, hits
+    # touch the file so eviction drops the least recently used ones
+    def __init__(self, directory, max_size=256 << 20):
+        self.directory = directory
+        self.max_size = max_size
+        self.size = None  # estimate, rescanned when over the limit
+        self.written = 0  # bytes put since the last scan
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(kind, data, encoding):
+        h = hashlib.sha256()
+        h.update(('%s\0%s\0%s\0%d\0' % (
+            kind, encoding, OPS_FINGERPRINT, FORMAT_VERSION)).encode())
+        h.update(data)
+        return h.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as fp:
+                data = fp.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return data
+
+    def put(self, key, data):
+        path = self.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            replaced = os.stat(path).st_size
+        except FileNotFoundError:
+            replaced = 0
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.written += len(data)
+        if self.size == None or self.written > self.max_size // RESCAN:
+            # entries of other processes are only seen by a scan
+            self.size = sum(size for _, size, _ in self.entries())
+            self.written = 0
+        else:
+            self.size += len(data) - replaced
+        if self.size > self.max_size:
+            self.evict()
+
+    def entries(self):
+        # (path, size, mtime) of every stored entry
+        for sub in os.scandir(self.directory):
+            if not sub.is_dir():
+                continue
+            for entry in os.scandir(sub.path):
+                if entry.name.endswith('.tmp'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                yield entry.path, stat.st_size, stat.st_mtime
+
+    def evict(self):
+        entries = sorted(self.entries(), key=lambda e: e[2])
+        self.size = sum(size for _, size, _ in entries)
+        self.written = 0
+        for path, size, _ in entries:
+            if self.size <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            self.size -= size
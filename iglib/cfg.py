@@ -0,0 +1,190 @@
+#!/bin/env python3
+import json
+
+from . import flowerscript
+
+# control flow, by op name (see OPS in flowerscript)
+BRANCHES = {'jmp_eq', 'jmp_be', 'jmp_le', 'jmp_nishuume', '0x5f'}
+JUMPS = {'jmp'}
+SELECT_BEG = 'sel_beg'
+SELECT_ADD = 'sel_add'
+SELECT_END = 'sel_end'
+EXITS = {'exit'}
+SCRIPT_JUMP = 'jmp_script'
+MARK_END = 'mark_end'
+
+
+class Block:
+    # instructions[first:last] of a script, from offset start to end
+    __slots__ = ('start', 'end', 'first', 'last', 'succs', 'preds')
+
+    def __init__(self, start, first):
+        self.start = start
+        self.end = None
+        self.first = first
+        self.last = None
+        self.succs = []
+        self.preds = []
+
+    def __repr__(self):
+        return 'Block(0x%x, succs=[%s])' % (
+            self.start, ', '.join('0x%x' % x for x in self.succs))
+
+
+def build_cfg(instructions, size=None):
+    # returns {start offset: Block} in offset order, size is the script
+    # length, used as end of the last block; jump targets that do not point
+    # to an instruction are left out
+    if not instructions:
+        return {}
+    offsets = {ins.offset for ins in instructions}
+    leaders = {instructions[0].offset}
+    prev = None
+    for ins in instructions:
+        if prev != None:
+            leaders.add(ins.offset)
+            prev = None
+        opname = ins.op.opname
+        leaders.update(x for x in ins.targets() if x in offsets)
+        if opname in BRANCHES or opname in JUMPS or opname in EXITS \
+                or opname == SELECT_END:
+            prev = ins
+    blocks = {}
+    block = None
+    choices = []
+    for i, ins in enumerate(instructions):
+        if ins.offset in leaders:
+            if block != None:
+                block.last = i
+                block.end = ins.offset
+                last = instructions[i - 1].op.opname
+                if not (last in JUMPS or last in EXITS or last == SELECT_END):
+                    block.succs.append(ins.offset)
+            block = blocks[ins.offset] = Block(ins.offset, i)
+        opname = ins.op.opname
+        if opname == SELECT_BEG:
+            choices = []
+        elif opname == SELECT_ADD:
+            choices.extend(x for x in ins.targets() if x in offsets)
+        elif opname == SELECT_END:
+            block.succs.extend(choices)
+            choices = []
+        elif opname in BRANCHES or opname in JUMPS:
+            block.succs.extend(x for x in ins.targets() if x in offsets)
+    block.last = len(instructions)
+    block.end = size
+    for block in blocks.values():
+        # keep order, drop duplicates
+        block.succs = list(dict.fromkeys(block.succs))
+        for succ in block.succs:
+            blocks[succ].preds.append(block.start)
+    return blocks
+
+
+class XrefIndex:
+    # jumps:   {script: {target offset: [(script, offset) of jumps]}}
+    # calls:   {script: [scripts it jmp_script's to]}
+    # callers: {script: [scripts that jmp_script to it]}
+    # endings: {ending no.: [(script, offset) of mark_end]}
+    # reaches: {ending no.: [scripts from which the ending can be reached]}
+    def __init__(self):
+        self.jumps = {}
+        self.calls = {}
+        self.callers = {}
+        self.endings = {}
+        self.reaches = {}
+        self._reaches = {}
+
+    def add_script(self, script, instructions):
+        jumps = self.jumps.setdefault(script, {})
+        calls = self.calls.setdefault(script, [])
+        for ins in instructions:
+            opname = ins.op.opname
+            for target in ins.targets():
+                jumps.setdefault(target, []).append((script, ins.offset))
+            if opname == SCRIPT_JUMP and ins.string not in calls:
+                calls.append(ins.string)
+            elif opname == MARK_END:
+                self.endings.setdefault(ins.args[0], []).append(
+                    (script, ins.offset))
+
+    def link(self):
+        # cross-script data, after all scripts are added; callee names are
+        # matched case-insensitively against the added scripts, as the
+        # manifest matches them against the archive
+        names = {script.lower(): script for script in self.jumps}
+        self.callers = {}
+        for script, calls in self.calls.items():
+            calls = self.calls[script] = list(dict.fromkeys(
+                names.get(callee.lower(), callee) for callee in calls))
+            for callee in calls:
+                self.callers.setdefault(callee, []).append(script)
+        self.reaches = {}
+        for ending, sites in self.endings.items():
+            todo = list(dict.fromkeys(script for script, _ in sites))
+            seen = set(todo)
+            while todo:
+                for caller in self.callers.get(todo.pop(), ()):
+                    if caller not in seen:
+                        seen.add(caller)
+                        todo.append(caller)
+            self.reaches[ending] = sorted(seen)
+        self._reaches = {k: set(v) for k, v in self.reaches.items()}
+
+    # queries
+
+    def jumps_to(self, script, offset):
+        return self.jumps.get(script, {}).get(offset, [])
+
+    def callers_of(self, script):
+        return self.callers.get(script, [])
+
+    def reaching(self, ending):
+        return self.reaches.get(ending, [])
+
+    def can_reach(self, script, ending):
+        return script in self._reaches.get(ending, ())
+
+    # serialization
+
+    def to_json(self):
+        return {
+            'jumps': {
+                script: [[target, sites] for target, sites in targets.items()]
+                for script, targets in self.jumps.items()
+            },
+            'calls': self.calls,
+            'endings': [[n, sites] for n, sites in self.endings.items()],
+        }
+
+    @classmethod
+    def from_json(cls, obj):
+        index = cls()
+        for script, targets in obj['jumps'].items():
+            index.jumps[script] = {
+                target: [tuple(site) for site in sites]
+                for target, sites in targets
+            }
+        index.calls = obj['calls']
+        index.endings = {
+            n: [tuple(site) for site in sites] for n, sites in obj['endings']
+        }
+        index.link()
+        return index
+
+    def save(self, fp):
+        json.dump(self.to_json(), fp, ensure_ascii=False,
+                  separators=(',', ':'))
+
+    @classmethod
+    def load(cls, fp):
+        return cls.from_json(json.load(fp))
+
+
+def build_index(archive, encoding=flowerscript.ENCODING):
+    # archive: an IgaArchive, or any {name: data} mapping
+    index = XrefIndex()
+    for name in archive:
+        index.add_script(name, flowerscript.decode(archive[name], encoding))
+    index.link()
+    return index
@@ -0,0 +1,99 @@
+#!/bin/env python3
+import json
+
+from . import flowerscript
+
+# op name: (argument index of the address, argument index of the value)
+WRITES = {'val_set': (0, 1), 'val_add': (0, 1)}
+READS = {'jmp_eq': (1, 3), 'jmp_be': (1, 3), 'jmp_le': (1, 3)}
+
+
+def script_sites(script, instructions):
+    # yields (address, is_write, (script, offset, op, value))
+    for ins in instructions:
+        opname = ins.op.opname
+        if opname in WRITES or opname in READS:
+            is_write = opname in WRITES
+            addr, value = (WRITES if is_write else READS)[opname]
+            site = (script, ins.offset, opname, ins.args[value])
+            yield ins.args[addr], is_write, site
+
+
+class VarIndex:
+    # per address and per script, so one script is replaced without
+    # touching the rest: {address: ({script: reads}, {script: writes})}
+    def __init__(self):
+        self.addresses = {}
+        self.scripts = {}  # script: addresses it touches
+
+    def update(self, script, instructions):
+        self.remove(script)
+        touched = self.scripts[script] = set()
+        for address, is_write, site in script_sites(script, instructions):
+            sites = self.addresses.setdefault(address, ({}, {}))[is_write]
+            sites.setdefault(script, []).append(site)
+            touched.add(address)
+
+    def remove(self, script):
+        for address in self.scripts.pop(script, ()):
+            entry = self.addresses[address]
+            for sites in entry:
+                sites.pop(script, None)
+            if not entry[0] and not entry[1]:
+                del self.addresses[address]
+
+    # queries, sites are (script, offset, op, value)
+
+    def reads(self, address, script=None):
+        return self._sites(address, 0, script)
+
+    def writes(self, address, script=None):
+        return self._sites(address, 1, script)
+
+    def sites(self, address, script=None):
+        return sorted(
+            self.reads(address, script) + self.writes(address, script))
+
+    def _sites(self, address, is_write, script):
+        entry = self.addresses.get(address)
+        if entry == None:
+            return []
+        if script != None:
+            return list(entry[is_write].get(script, ()))
+        return [site for sites in entry[is_write].values() for site in sites]
+
+    # serialization
+
+    def to_json(self):
+        return [
+            [address, list(self.reads(address)), list(self.writes(address))]
+            for address in sorted(self.addresses)
+        ]
+
+    @classmethod
+    def from_json(cls, obj):
+        index = cls()
+        for address, reads, writes in obj:
+            for is_write, sites in enumerate((reads, writes)):
+                for site in sites:
+                    script = site[0]
+                    index.addresses.setdefault(address, ({}, {}))[is_write] \
+                        .setdefault(script, []).append(tuple(site))
+                    index.scripts.setdefault(script, set()).add(address)
+        return index
+
+    def save(self, fp):
+        json.dump(self.to_json(), fp, ensure_ascii=False,
+                  separators=(',', ':'))
+
+    @classmethod
+    def load(cls, fp):
+        return cls.from_json(json.load(fp))
+
+
+def build_var_index(archive, encoding=flowerscript.ENCODING):
+    # archive: an IgaArchive, or any {name: data} mapping
+    index = VarIndex()
+    for name in archive:
+        index.update(name, flowerscript.decode(archive[name], encoding))
+    return index
@@ -1,4 +1,12 @@
+import bisect
+import contextlib
 import enum
+import json
+import mmap
+import os
+import struct
+import threading
+import time
 
 
 ENCODING = 'cp932'
@@ -27,12 +35,16 @@ def fmt_number(number, fmt='0x%02x'):
     return fmt % number
 
 
+def lbl_name(offset):
+    return 'label_0x%x' % offset
+
+
 def fmt_offset(offset):
-    return 's.label_0x%x' % offset
+    return 's.' + lbl_name(offset)
 
 
 def fmt_list(data):
-    return '[%s]' % (', '.join(fmt_number(x) for x in data))
+    return '[%s]' % (', '.join(map('0x%02x'.__mod__, data)))
 
 
 class Type(enum.Enum):
@@ -44,6 +56,17 @@ class Type(enum.Enum):
     BARRAY = 5
 
 
+STRUCT_CODES = {1: 'B', 2: 'H', 4: 'I', 8: 'Q'}
+
+FMT_CODES = {
+    Type.HEXNUM: '0x%02x',
+    Type.SG_DEC: '%d',
+    Type.UN_DEC: '%d',
+    Type.OFFSET: 's.label_0x%x',
+    Type.BARRAY: '%s',
+}
+
+
 class Op:
     def __init__(self, opname):
         self.opname = opname
@@ -55,35 +78,218 @@ class Op:
         self.opsize += size
         return self
 
-    def r(self, fp, encoding, label_set):
-        segs = []
-        slen = None
+    def compile(self):
+        # one struct for all fixed fields, plus the kind of every argument
+        # (STRLEN fields are not arguments)
+        fmt = '<'
+        pack_fmt = '<BB'  # with the op header, integers always unsigned
+        self.kinds = []
+        self.wides = []
+        self.slen_index = self.slen_limit = None
+        self.limits = []
+        self.target_slots = []
+        offset = 2
         for size, tp in self.fields:
-            data = fp.read(size)
-            if tp == Type.HEXNUM:
-                segs.append(fmt_number(le_fr(data)))
-            if tp == Type.SG_DEC:
-                segs.append(fmt_number(le_fr(data, True), '%d'))
-            if tp == Type.UN_DEC:
-                segs.append(fmt_number(le_fr(data, False), '%d'))
-            if tp == Type.OFFSET:
-                offset = le_fr(data)
-                label_set.add(offset)
-                segs.append(fmt_offset(offset))
             if tp == Type.STRLEN:
-                slen = le_fr(data)
-            if tp == Type.BARRAY:
-                segs.append(fmt_list(data))
-        if slen != None:
-            data = fp.read(slen)
-            if (i := data.find(0)) == -1:
-                tail = None
+                self.slen_index = len(self.kinds)
+                self.slen_limit = 1 << (size * 8)
+            elif tp == Type.OFFSET:
+                self.target_slots.append((len(self.kinds), offset, size))
+            elif tp != Type.BARRAY:
+                self.limits.append((len(self.kinds), 1 << (size * 8)))
+            if tp != Type.BARRAY and size not in STRUCT_CODES:
+                # e.g. the 6 bytes of fg_clear, converted after unpacking
+                self.wides.append((len(self.kinds), tp == Type.SG_DEC, size))
+            if tp == Type.BARRAY or size not in STRUCT_CODES:
+                fmt += '%ds' % size
+                pack_fmt += '%ds' % size
+            elif tp == Type.SG_DEC:
+                fmt += STRUCT_CODES[size].lower()
+                pack_fmt += STRUCT_CODES[size]
             else:
+                fmt += STRUCT_CODES[size]
+                pack_fmt += STRUCT_CODES[size]
+            if tp != Type.STRLEN:
+                self.kinds.append(tp)
+            offset += size
+        self.struct = struct.Struct(fmt)
+        self.pack_struct = struct.Struct(pack_fmt)
+        self.nargs = len(self.kinds)
+        # indices into the unpacked tuple, for scan_targets
+        self.target_items = [
+            i + (self.slen_index != None and i >= self.slen_index)
+            for i, tp in enumerate(self.kinds) if tp == Type.OFFSET]
+        self.targets_index = [
+            i for i, tp in enumerate(self.kinds) if tp == Type.OFFSET]
+        self.barrays = [
+            (i, size) for (size, tp), i in zip(
+                [f for f in self.fields if f[1] != Type.STRLEN],
+                range(self.nargs)) if tp == Type.BARRAY]
+        self.template = ', '.join(FMT_CODES[tp] for tp in self.kinds)
+        name = repr(self.opname).replace('%', '%%')
+        # a whole line up to the string, for format
+        self.head = 's.op(%s, %s' % (name, self.template)
+        # a whole line from the fixed fields alone, for disasm: BARRAY bytes
+        # are unpacked one by one, the STRLEN value is skipped by %.0s and
+        # the repr of the string fills the last %s
+        self.line_struct = self.line_slen = None
+        if not self.wides:
+            line_fmt = '<'
+            line = 's.op(%s' % name
+            self.line_targets = []  # positions among the unpacked values
+            for size, tp in self.fields:
+                if tp == Type.STRLEN:
+                    self.line_slen = len(line_fmt) - 1
+                    line_fmt += STRUCT_CODES[size]
+                    line += '%.0s'
+                elif tp == Type.BARRAY:
+                    line_fmt += 'B' * size
+                    line += ', [' + ', '.join(['0x%02x'] * size) + ']'
+                else:
+                    if tp == Type.OFFSET:
+                        self.line_targets.append(len(line_fmt) - 1)
+                    line_fmt += STRUCT_CODES[size].lower() \
+                        if tp == Type.SG_DEC else STRUCT_CODES[size]
+                    line += ', ' + FMT_CODES[tp]
+            self.line_struct = struct.Struct(line_fmt)
+            self.line = line + (', %s)' if self.slen_index != None else ')')
+        self.blank = bytes(self.opsize)
+
+    def extra(self, args, encoding):
+        # the data following the fixed fields: the string and its tail
+        if self.slen_index == None:
+            return b''
+        extra = args[self.nargs].encode(encoding)
+        if len(args) > self.nargs + 1:
+            extra += bytes(args[self.nargs + 1])
+        return extra
+
+    def string_size(self, args, size):
+        # bytes of the encoded string in the size bytes of extra, without
+        # its tail
+        if self.slen_index != None and len(args) > self.nargs + 1:
+            return size - len(args[self.nargs + 1])
+        return size
+
+    def pack_into(self, buf, pos, opcode, args, extra):
+        # writes opsize bytes at pos, returns the (label, offset, size)
+        # slots to patch; extra is what self.extra returned
+        values = list(args[:self.nargs])
+        if len(values) < self.nargs:
+            raise IndexError('%s takes %d arguments' % (
+                self.opname, self.nargs))
+        for i, limit in self.limits:
+            value = values[i]
+            if value < 0:
+                if value < -limit:
+                    raise ValueError('number out of range')
+                values[i] = value + limit
+            elif value >= limit:
+                raise ValueError('number out of range')
+        for i, size in self.barrays:
+            if len(values[i]) != size:
+                raise ValueError('data length not equal to definition')
+            values[i] = bytes(values[i])
+        if self.wides:
+            for i, _, size in self.wides:
+                values[i] = values[i].to_bytes(size, 'little')
+        labels = ()
+        if self.target_slots:
+            labels = []
+            for i, offset, size in self.target_slots:
+                labels.append((values[i], pos + offset, size))
+                values[i] = (1 << (size * 8)) - 1
+        if self.slen_index != None:
+            if not len(extra) < self.slen_limit:
+                raise ValueError('number out of range')
+            values.insert(self.slen_index, len(extra))
+        self.pack_struct.pack_into(buf, pos, opcode, self.opsize, *values)
+        return labels
+
+    def unpack_from(self, view, pos, encoding):
+        # view: memoryview of the script, pos: offset after the op header
+        args = list(self.struct.unpack_from(view, pos))
+        pos += self.struct.size
+        string = tail = None
+        if self.slen_index != None:
+            slen = args.pop(self.slen_index)
+            data = view[pos:pos+slen].tobytes()
+            pos += slen
+            if (i := data.find(0)) != -1:
                 data, tail = data[:i], data[i:]
-            segs.append(repr(data.decode(encoding)))
-            if tail != None:
-                segs.append(fmt_list(tail))
-        return 's.op(%s, %s)' % (repr(self.opname), ', '.join(segs))
+            tracer = _active.tracer
+            if tracer == None:
+                string = data.decode(encoding)
+            else:
+                string = tracer.decode_string(data, encoding)
+        if self.wides:
+            for i, signed, _ in self.wides:
+                args[i] = int.from_bytes(args[i], 'little', signed=signed)
+        return args, string, tail, pos
+
+    def read(self, fp, encoding):
+        data = fp.read(self.struct.size)
+        if self.slen_index != None:
+            slen = self.struct.unpack(data)[self.slen_index]
+            data += fp.read(slen)
+        return self.unpack_from(memoryview(data), 0, encoding)[:3]
+
+    def targets(self, args):
+        return [args[i] for i in self.targets_index]
+
+    def format(self, ins):
+        args = ins.args
+        if self.barrays:
+            args = list(args)
+            for i, _ in self.barrays:
+                args[i] = fmt_list(args[i])
+        line = self.head % tuple(args)
+        if ins.string != None:
+            line += ', ' + repr(ins.string)
+            if ins.tail != None:
+                line += ', ' + fmt_list(ins.tail)
+        return line + ')'
+
+    def r(self, fp, encoding, label_set):
+        ins = Instruction(None, None, *self.read(fp, encoding))
+        label_set.update(self.targets(ins.args))
+        return self.format(ins)
+
+
+class Instruction:
+    # args: field values in order, without the STRLEN fields
+    # (OFFSET: target offset, BARRAY: bytes, others: int)
+    # string: decoded text of the STRLEN field, tail: bytes from the first NUL
+    __slots__ = ('offset', 'opcode', 'args', 'string', 'tail')
+
+    def __init__(self, offset, opcode, args, string=None, tail=None):
+        self.offset = offset
+        self.opcode = opcode
+        self.args = args
+        self.string = string
+        self.tail = tail
+
+    def __repr__(self):
+        return 'Instruction(%r, %r, %r, %r, %r)' % (
+            self.offset, self.opcode, self.args, self.string, self.tail)
+
+    @property
+    def op(self):
+        return OPS[self.opcode]
+
+    def targets(self):
+        return OPS[self.opcode].targets(self.args)
+
+    def arguments(self):
+        # the arguments of Assembler.op
+        if self.string == None:
+            return self.args
+        if self.tail == None:
+            return self.args + [self.string]
+        return self.args + [self.string, self.tail]
+
+    def format(self):
+        return OPS[self.opcode].format(self)
 
 
 OPS = {
@@ -221,7 +427,7 @@ OPS = {
     0x3f: Op('add_backlog')
     .field(1, Type.HEXNUM)
     .field(1, Type.STRLEN),
-    0x40: Op('dlg_mode')
+    0x40: Op('dlg_mode_40')  # same fields as dlg_mode (0xb6)
     .field(2, Type.UN_DEC),
     0x4c: Op('dlg_clear')         # ZhangHai: clear vertical messages
     .field(2, Type.HEXNUM),
@@ -330,41 +536,410 @@ OPS = {
     .field(14, Type.BARRAY)
 }
 
+for op in OPS.values():
+    op.compile()
+
 OPS_BYNAME = dict(map(lambda kv: (kv[1].opname, (kv[0], kv[1])), OPS.items()))
+# disasm text refers to ops by name, which must lead back to the opcode
+assert len(OPS_BYNAME) == len(OPS), 'duplicate op names'
+
+# opcode: what disasm needs of the ops with a line template
+DISASM_LINES = {
+    opcode: (op.line_struct.unpack_from, op.line, op.line_slen,
+             op.line_targets, op.opsize)
+    for opcode, op in OPS.items() if op.line_struct != None
+}
 
 
-statistics = {}
+class Statistics:
+    # an opt-in collector for decode: per opcode counts, bytes, string bytes
+    # and decode seconds; use one per thread or process and merge them
+    def __init__(self):
+        self.counts = {}
+        self.sizes = {}
+        self.string_sizes = {}
+        self.times = {}
 
+    def add(self, opcode, size, string_size, seconds):
+        self.counts[opcode] = self.counts.get(opcode, 0) + 1
+        self.sizes[opcode] = self.sizes.get(opcode, 0) + size
+        self.string_sizes[opcode] = \
+            self.string_sizes.get(opcode, 0) + string_size
+        self.times[opcode] = self.times.get(opcode, 0.0) + seconds
 
-def disasm(fp, encoding=ENCODING):
-    lines = []
-    label_set = set()
-    while len(data := fp.read(2)) == 2:
-        offset = fp.tell() - 2
-        opcode, opsize = data
-        if opcode in OPS:
-            statistics[opcode] = statistics.get(opcode, 0) + 1
-            lines.append((offset, OPS[opcode].r(fp, encoding, label_set)))
-        else:
+    def merge(self, other):
+        for mine, theirs in (
+            (self.counts, other.counts),
+            (self.sizes, other.sizes),
+            (self.string_sizes, other.string_sizes),
+            (self.times, other.times),
+        ):
+            for opcode, value in theirs.items():
+                mine[opcode] = mine.get(opcode, 0) + value
+        return self
+
+    def __add__(self, other):
+        return Statistics().merge(self).merge(other)
+
+    def rows(self):
+        # (opcode, opname, count, bytes, string bytes, seconds), most
+        # frequent first
+        return [
+            (opcode, OPS[opcode].opname, count, self.sizes[opcode],
+             self.string_sizes[opcode], self.times[opcode])
+            for opcode, count in sorted(
+                self.counts.items(), key=lambda kv: (-kv[1], kv[0]))
+        ]
+
+
+class _Active(threading.local):
+    # the Tracer entered by this thread, hooks on the hot paths only check
+    # it against None
+    tracer = None
+
+
+_active = _Active()
+
+
+class Tracer:
+    # opt-in profiling of decode and encode, active inside a with block and
+    # only for the thread that entered it:
+    #   with Tracer() as tracer:
+    #       disasm(data)
+    #   tracer.save_chrome_trace(fp)
+    # decoded/encoded are per opcode Statistics, strings holds
+    # [count, bytes, seconds] of string decoding per encoding and spans
+    # the timed calls (decode, finish) for chrome://tracing or Perfetto
+    def __init__(self):
+        self.decoded = Statistics()
+        self.encoded = Statistics()
+        self.strings = {}
+        self.spans = []
+        self.origin = time.perf_counter()
+        self.previous = None
+
+    def __enter__(self):
+        self.previous, _active.tracer = _active.tracer, self
+        return self
+
+    def __exit__(self, *exc):
+        _active.tracer, self.previous = self.previous, None
+
+    def decode_string(self, data, encoding):
+        beg = time.perf_counter()
+        string = data.decode(encoding)
+        seconds = time.perf_counter() - beg
+        row = self.strings.setdefault(encoding, [0, 0, 0.0])
+        row[0] += 1
+        row[1] += len(data)
+        row[2] += seconds
+        return string
+
+    @contextlib.contextmanager
+    def span(self, name, **args):
+        beg = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.spans.append((name, beg, time.perf_counter() - beg, args))
+
+    def label_seconds(self):
+        return sum(dur for name, _, dur, _ in self.spans if name == 'finish')
+
+    def to_json(self):
+        def table(stats):
+            return [
+                {'opcode': opcode, 'opname': opname, 'count': count,
+                 'bytes': size, 'string_bytes': string_size,
+                 'seconds': seconds}
+                for opcode, opname, count, size, string_size, seconds
+                in stats.rows()
+            ]
+        return {
+            'decode': table(self.decoded),
+            'encode': table(self.encoded),
+            'strings': {
+                encoding: {'count': count, 'bytes': size, 'seconds': seconds}
+                for encoding, (count, size, seconds) in self.strings.items()
+            },
+            'labels': {
+                'count': sum(1 for span in self.spans if span[0] == 'finish'),
+                'seconds': self.label_seconds(),
+            },
+        }
+
+    def save(self, fp):
+        json.dump(self.to_json(), fp, indent=1)
+
+    def save_chrome_trace(self, fp, pid=None, tid=0):
+        # Trace Event Format, complete ('X') events in microseconds
+        pid = os.getpid() if pid == None else pid
+        events = [
+            {'name': name, 'ph': 'X', 'pid': pid, 'tid': tid,
+             'ts': (beg - self.origin) * 1e6, 'dur': dur * 1e6, 'args': args}
+            for name, beg, dur, args in self.spans
+        ]
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fp)
+
+
+def as_view(data):
+    # bytes-like objects (bytes, memoryview, mmap...) are used in place,
+    # file objects are read once
+    if hasattr(data, 'read') and not isinstance(data, mmap.mmap):
+        data = data.read()
+    view = memoryview(data)
+    if view.format != 'B' or view.ndim != 1:
+        view = view.cast('B')
+    return view
+
+
+def iter_decode(data, encoding=ENCODING, stats=None):
+    # stats: an optional Statistics, without one (and without an active
+    # Tracer) nothing is measured
+    view = as_view(data)
+    tracer = _active.tracer
+    if tracer != None:
+        collectors = [tracer.decoded] + ([stats] if stats != None else [])
+        return _iter_decode_stats(view, encoding, collectors)
+    if stats != None:
+        return _iter_decode_stats(view, encoding, [stats])
+    return _iter_decode(view, encoding)
+
+
+def _iter_decode(view, encoding):
+    end = len(view) - 1
+    pos = 0
+    while pos < end:
+        opcode = view[pos]
+        op = OPS.get(opcode)
+        if op is None:
+            raise NotImplementedError(
+                'unimplemented opcode %02x at offset %x' % (opcode, pos))
+        args, string, tail, next_pos = op.unpack_from(view, pos + 2, encoding)
+        yield Instruction(pos, opcode, args, string, tail)
+        pos = next_pos
+
+
+def _iter_decode_stats(view, encoding, collectors):
+    clock = time.perf_counter
+    end = len(view) - 1
+    pos = 0
+    while pos < end:
+        opcode = view[pos]
+        op = OPS.get(opcode)
+        if op is None:
             raise NotImplementedError(
-                'unimplemented opcode %02x at offset %x' % (opcode, offset))
-        # print(lines[-1])
-    i = 0
-    while i < len(lines):
-        offset, line = lines[i]
-        if offset in label_set:
-            label_set.remove(offset)
-            lines.insert(i, (offset, fmt_offset(offset) + '.define()'))
-            i += 1
-        i += 1
-    if len(label_set) > 0:
-        print('- Warning: not all jumps are pointing to an instruction -')
-        for offset in label_set:
-            text = fmt_offset(offset) + '.define_as(0x%x)' % offset
-            print('=>', text)
-            lines.append((offset, text))
-        print('- end of warning -')
-    return [x[1] for x in lines]
+                'unimplemented opcode %02x at offset %x' % (opcode, pos))
+        beg = clock()
+        args, string, tail, next_pos = op.unpack_from(view, pos + 2, encoding)
+        seconds = clock() - beg
+        size = next_pos - pos
+        string_size = size - op.opsize
+        if tail:
+            string_size -= len(tail)
+        for stats in collectors:
+            stats.add(opcode, size, string_size, seconds)
+        yield Instruction(pos, opcode, args, string, tail)
+        pos = next_pos
+
+
+def decode(data, encoding=ENCODING, stats=None):
+    tracer = _active.tracer
+    if tracer != None:
+        with tracer.span('decode', encoding=encoding):
+            return list(iter_decode(data, encoding, stats))
+    return list(iter_decode(data, encoding, stats))
+
+
+def scan_targets(data):
+    # only walks instruction sizes and OFFSET fields, nothing is decoded
+    targets = set()
+    view = as_view(data)
+    end = len(view) - 1
+    pos = 0
+    while pos < end:
+        op = OPS.get(view[pos])
+        if op is None:
+            raise NotImplementedError(
+                'unimplemented opcode %02x at offset %x' % (view[pos], pos))
+        if op.target_items or op.slen_index != None:
+            items = op.struct.unpack_from(view, pos + 2)
+            for i in op.target_items:
+                targets.add(items[i])
+            if op.slen_index != None:
+                pos += items[op.slen_index]
+        pos += op.opsize
+    return targets
+
+
+def verify(data, encoding=ENCODING):
+    # decode and assemble again in memory, returns None when the bytes are
+    # reproduced, else (offset, opcode) at the first difference; opcode is
+    # None past the last instruction
+    view = as_view(data)
+    instructions = decode(view, encoding)
+    result = Assembler.from_records(instructions, encoding).bytes
+    if view == result:
+        return None
+    size = min(len(view), len(result))
+    offset = size
+    for beg in range(0, size, 0x1000):
+        end = min(beg + 0x1000, size)
+        if view[beg:end] != result[beg:end]:
+            offset = next(
+                i for i in range(beg, end) if view[i] != result[i])
+            break
+    i = bisect.bisect_right([ins.offset for ins in instructions], offset)
+    if i == 0 or offset >= len(result):
+        return offset, None
+    return offset, instructions[i - 1].opcode
+
+
+class Disassembly(list):
+    # lines of text, with dangling: sorted jump targets that do not point
+    # to an instruction (they are defined with define_as at the end)
+    def __init__(self, lines=(), dangling=()):
+        super().__init__(lines)
+        self.dangling = list(dangling)
+
+
+def place_labels(instructions, targets, dangling=None):
+    # merge label definitions into the offset ordered instruction stream,
+    # yielding lines; targets not found are appended to dangling
+    targets = set(targets)
+    for ins in instructions:
+        if ins.offset in targets:
+            targets.remove(ins.offset)
+            yield fmt_offset(ins.offset) + '.define()'
+        yield OPS[ins.opcode].format(ins)
+    targets = sorted(targets)
+    if dangling != None:
+        dangling.extend(targets)
+    for offset in targets:
+        yield fmt_offset(offset) + '.define_as(0x%x)' % offset
+
+
+def _disasm_chunks(view, encoding, targets, chunk=0x1000):
+    # the walk of disasm and iter_disasm, over view in place and without
+    # Instruction records: one unpack and one template per line
+    # (DISASM_LINES), strings with a tail and wide fields take the general
+    # path; yields (offsets, lines) per chunk bytes of input and adds the
+    # jump targets to targets
+    table = DISASM_LINES
+    end = len(view) - 1
+    pos = 0
+    while pos < end:
+        offsets = []
+        lines = []
+        add_offset = offsets.append
+        append = lines.append
+        pending = []  # strings are decoded all at once per chunk
+        texts = []
+        stop = min(pos + chunk, end)
+        while pos < stop:
+            opcode = view[pos]
+            add_offset(pos)
+            info = table.get(opcode)
+            if info != None:
+                unpack, line, slen_index, target_items, opsize = info
+                values = unpack(view, pos + 2)
+                if target_items:
+                    for i in target_items:
+                        targets.add(values[i])
+                if slen_index == None:
+                    append(line % values)
+                    pos += opsize
+                    continue
+                beg = pos + opsize
+                text = view[beg:beg+values[slen_index]].tobytes()
+                if 0 not in text:
+                    pending.append((len(lines), line, values))
+                    texts.append(text)
+                    append(None)
+                    pos = beg + values[slen_index]
+                    continue
+            op = OPS.get(opcode)
+            if op is None:
+                raise NotImplementedError(
+                    'unimplemented opcode %02x at offset %x' % (opcode, pos))
+            args, string, tail, next_pos = op.unpack_from(
+                view, pos + 2, encoding)
+            targets.update(op.targets(args))
+            append(op.format(Instruction(pos, opcode, args, string, tail)))
+            pos = next_pos
+        # NUL separated, one decode call per chunk; per string again to
+        # raise at the right one, or for a codec that does not keep them
+        try:
+            strings = b'\0'.join(texts).decode(encoding).split('\0')
+        except UnicodeDecodeError:
+            strings = None
+        if strings == None or len(strings) != len(texts):
+            strings = [text.decode(encoding) for text in texts]
+        for (i, line, values), string in zip(pending, strings):
+            lines[i] = line % (*values, repr(string))
+        yield offsets, lines
+
+
+def _iter_disasm(view, encoding, targets, dangling):
+    # label definitions go before their instruction, targets come from
+    # the pre-scan
+    targets = set(targets)
+    for offsets, lines in _disasm_chunks(view, encoding, set()):
+        for pos, line in zip(offsets, lines):
+            if pos in targets:
+                targets.remove(pos)
+                yield fmt_offset(pos) + '.define()'
+            yield line
+    targets = sorted(targets)
+    if dangling != None:
+        dangling.extend(targets)
+    for offset in targets:
+        yield fmt_offset(offset) + '.define_as(0x%x)' % offset
+
+
+def iter_disasm(data, encoding=ENCODING, dangling=None, stats=None):
+    # lines are yielded as they are decoded, after a pre-scan for labels
+    view = as_view(data)
+    targets = scan_targets(view)
+    if stats == None and _active.tracer == None:
+        return _iter_disasm(view, encoding, targets, dangling)
+    return place_labels(iter_decode(view, encoding, stats), targets, dangling)
+
+
+def disasm(data, encoding=ENCODING, stats=None):
+    if stats == None and _active.tracer == None:
+        lines = []
+        offsets = []
+        targets = set()
+        for chunk_offsets, chunk_lines in _disasm_chunks(
+                as_view(data), encoding, targets):
+            offsets += chunk_offsets
+            lines += chunk_lines
+        # label definitions go before their instruction, in one merge
+        result = Disassembly()
+        beg = 0
+        for target in sorted(targets):
+            i = bisect.bisect_left(offsets, target)
+            if i == len(offsets) or offsets[i] != target:
+                result.dangling.append(target)
+                continue
+            result.extend(lines[beg:i])
+            result.append(fmt_offset(target) + '.define()')
+            beg = i
+        result.extend(lines[beg:])
+        result.extend(
+            fmt_offset(offset) + '.define_as(0x%x)' % offset
+            for offset in result.dangling)
+        return result
+    instructions = decode(data, encoding, stats)
+    label_set = set()
+    for ins in instructions:
+        op = OPS[ins.opcode]
+        if op.targets_index:
+            label_set.update(op.targets(ins.args))
+    result = Disassembly()
+    result.extend(place_labels(instructions, label_set, result.dangling))
+    return result
 
 
 class Label:
@@ -388,53 +963,160 @@ class Assembler:
         self.bytes = bytearray()
         self.lbl_refs = []
         self.lbl_offs = {}
+        self.labels = {}
 
-    def __getattribute__(self, name):
+    def __getattr__(self, name):
+        # only called for names that are not found, i.e. s.label_xxx
         if name.startswith('label_'):
-            return Label(self, name)
-        return object.__getattribute__(self, name)
+            return self.label(name[6:])
+        raise AttributeError(
+            '%r object has no attribute %r' % (type(self).__name__, name))
+
+    def label(self, name):
+        # s.label('0x64') is s.label_0x64, one Label object per name
+        label = self.labels.get(name)
+        if label is None:
+            label = self.labels[name] = Label(self, 'label_' + name)
+        return label
 
     def finish(self):
+        tracer = _active.tracer
+        if tracer != None:
+            with tracer.span('finish', labels=len(self.lbl_refs)):
+                return self._finish()
+        return self._finish()
+
+    def _finish(self):
         for name, offset, size in self.lbl_refs:
             value = self.lbl_offs[name]
             self.bytes[offset:offset+size] = le_to(value, size)
 
+    @classmethod
+    def from_records(cls, instructions, encoding=ENCODING):
+        asmer = cls(encoding)
+        asmer.extend(instructions)
+        asmer.finish()
+        return asmer
+
+    def extend(self, instructions):
+        # instructions: Instruction records or (opname or opcode, *args)
+        # tuples; sizes are computed first, then everything is written
+        # into one preallocated block
+        jobs = []
+        size = 0
+        trace = _active.tracer
+        if trace != None:
+            clock = time.perf_counter
+            times = []
+        for item in instructions:
+            if trace != None:
+                beg = clock()
+            if isinstance(item, Instruction):
+                opcode, args, offset = item.opcode, item.arguments(), item.offset
+                op = OPS[opcode]
+            else:
+                opcode, args, offset = item[0], item[1:], None
+                if opcode in OPS_BYNAME:
+                    opcode, op = OPS_BYNAME[opcode]
+                elif opcode in OPS:
+                    op = OPS[opcode]
+                else:
+                    raise NotImplementedError('unknown op name %s' % opcode)
+            extra = op.extra(args, self.encoding)
+            jobs.append((opcode, op, args, extra, offset))
+            size += op.opsize + len(extra)
+            if trace != None:
+                times.append(clock() - beg)
+        buf = self.bytes
+        pos = start = len(buf)
+        buf += bytes(size)
+        # labels are only defined and referenced once every instruction is
+        # written, a failed batch leaves the Assembler as it was
+        defs = []
+        refs = []
+        try:
+            if trace == None:
+                for opcode, op, args, extra, offset in jobs:
+                    if offset != None:
+                        defs.append((offset, pos))
+                    labels = op.pack_into(buf, pos, opcode, args, extra)
+                    pos += op.opsize
+                    if extra:
+                        end = pos + len(extra)
+                        buf[pos:end] = extra
+                        pos = end
+                    if labels:
+                        refs += labels
+            else:
+                for (opcode, op, args, extra, offset), seconds in zip(
+                        jobs, times):
+                    beg = clock()
+                    if offset != None:
+                        defs.append((offset, pos))
+                    labels = op.pack_into(buf, pos, opcode, args, extra)
+                    pos += op.opsize
+                    buf[pos:pos+len(extra)] = extra
+                    pos += len(extra)
+                    if labels:
+                        refs += labels
+                    trace.encoded.add(opcode, op.opsize + len(extra),
+                                      op.string_size(args, len(extra)),
+                                      seconds + clock() - beg)
+        except Exception:
+            del buf[start:]
+            raise
+        lbl_offs = self.lbl_offs
+        for offset, pos in defs:
+            lbl_offs[lbl_name(offset)] = pos
+        if refs:
+            self.add_refs(refs)
+
+    def add_refs(self, labels):
+        for label, offset, size in labels:
+            if isinstance(label, int):
+                # a target offset from a decoded Instruction, it stays
+                # as is unless the instruction there gets added
+                value, label = label, self.label('0x%x' % label)
+                self.lbl_offs.setdefault(label.name, value)
+            label.add_ref(offset, size)
+
+    def add(self, ins):
+        # assemble a decoded Instruction, its offset defines a label so that
+        # OFFSET arguments of other records resolve to its new position
+        if ins.offset != None:
+            self.lbl_offs[lbl_name(ins.offset)] = len(self.bytes)
+        self.emit(ins.opcode, OPS[ins.opcode], ins.arguments())
+
     def op(self, opname, *args):
         if opname in OPS_BYNAME:
             opcode, op = OPS_BYNAME[opname]
         else:
             raise NotImplementedError('unknown op name %s' % opname)
-        self.bytes.append(opcode)
-        self.bytes.append(op.opsize)
-        slen_off = slen_siz = None
-        args = list(args)
-        for size, tp in op.fields:
-            if tp == Type.HEXNUM or tp == Type.SG_DEC or tp == Type.UN_DEC:
-                value = args.pop(0)
-                self.bytes.extend(le_to(value, size))
-                continue
-            if tp == Type.OFFSET:
-                label = args.pop(0)
-                label.add_ref(len(self.bytes), size)
-                self.bytes.extend(le_to(-1, size))
-                continue
-            if tp == Type.STRLEN:
-                slen_off = len(self.bytes)
-                slen_siz = size
-                self.bytes.extend(le_to(-1, size))
-                continue
-            if tp == Type.BARRAY:
-                array = args.pop(0)
-                if len(array) != size:
-                    raise ValueError('data length not equal to definition')
-                self.bytes.extend(array)
-                continue
-            raise Exception('should be unreachable !')
-        if slen_off != None:
-            str_dat = args.pop(0).encode(self.encoding)
-            self.bytes.extend(str_dat)
-            str_len = len(str_dat)
-            if len(args) > 0:
-                self.bytes.extend(args[0])
-                str_len += len(args[0])
-            self.bytes[slen_off:slen_off+slen_siz] = le_to(str_len, slen_siz)
+        self.emit(opcode, op, args)
+
+    def emit(self, opcode, op, args):
+        tracer = _active.tracer
+        if tracer != None:
+            start = len(self.bytes)
+            beg = time.perf_counter()
+            self._emit(opcode, op, args)
+            size = len(self.bytes) - start
+            tracer.encoded.add(
+                opcode, size, op.string_size(args, size - op.opsize),
+                time.perf_counter() - beg)
+            return
+        self._emit(opcode, op, args)
+
+    def _emit(self, opcode, op, args):
+        buf = self.bytes
+        pos = len(buf)
+        extra = op.extra(args, self.encoding)
+        buf += op.blank
+        try:
+            labels = op.pack_into(buf, pos, opcode, args, extra)
+        except Exception:
+            del buf[pos:]
+            raise
+        if labels:
+            self.add_refs(labels)
+        buf += extra
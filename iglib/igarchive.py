@@ -1,4 +1,15 @@
 #!/bin/env python3
+import concurrent.futures
+import mmap
+import os
+import time
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+IG_CHUNK = 0x10000  # must be a multiple of 256, the period of the key
 
 
 def ig_encode(value):
@@ -15,39 +26,409 @@ def ig_encode(value):
     return result
 
 
-def ig_encode_data(data):
+def ig_decode(data, offset=0):
+    value = 0
+    while True:
+        b = data[offset]
+        offset += 1
+        value = (value << 7) | (b >> 1)
+        if b & 0x1:
+            return value, offset
+
+
+# single byte values, the common case in the name table
+_IG_BYTES = [bytes(ig_encode(i)) for i in range(0x100)]
+_IG_HALVE = bytes(i >> 1 for i in range(0x100))
+_IG_ODDS = bytes(range(1, 0x100, 2))
+
+
+def ig_encode_list(values):
     result = bytearray()
-    for num in data:
-        result += ig_encode(num)
+    append = result.append
+    for value in values:
+        if 0 <= value < 0x80:
+            append((value << 1) | 0x1)
+        else:
+            result += ig_encode(value)
     return result
 
 
+def ig_encode_data(data):
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        return bytearray(b''.join(map(_IG_BYTES.__getitem__, data)))
+    return ig_encode_list(data)
+
+
+def ig_decode_list(data, offset=0, end=None):
+    if end is None:
+        end = len(data)
+    data = bytes(data[offset:end])
+    if data and not data[-1] & 0x1:
+        raise ValueError('unterminated number')
+    if not data.translate(None, _IG_ODDS):
+        return list(data.translate(_IG_HALVE))
+    values = []
+    append = values.append
+    value = 0
+    for b in data:
+        value = (value << 7) | (b >> 1)
+        if b & 0x1:
+            append(value)
+            value = 0
+    return values
+
+
+def ig_decode_data(data, offset=0, end=None):
+    if end is None:
+        end = len(data)
+    data = bytes(data[offset:end])
+    if not data.translate(None, _IG_ODDS):
+        return bytearray(data.translate(_IG_HALVE))
+    return bytearray(ig_decode_list(data))
+
+
+_ig_keys = {}
+
+
+def ig_keystream(xor=0x00, start=0):
+    # IG_CHUNK bytes of key beginning at position start within an entry
+    start = (start & 0xFF, xor & 0xFF)
+    if start not in _ig_keys:
+        rot, xor = start
+        key = bytes(((i + 2) ^ xor) & 0xFF for i in range(256))
+        key = (key[rot:] + key[:rot]) * (IG_CHUNK // 256)
+        if numpy is not None:
+            key = numpy.frombuffer(key, numpy.uint8)
+        else:
+            key = int.from_bytes(key, 'little')
+        _ig_keys[start] = key
+    return _ig_keys[start]
+
+
+def ig_transform_into(data, out, xor=0x00, start=0):
+    # start: position of data[0] within its entry, for chunked streams
+    key = ig_keystream(xor, start)
+    size = len(data)
+    if len(out) < size:
+        raise ValueError('output buffer too small')
+    if numpy is not None:
+        src = numpy.frombuffer(data, numpy.uint8)
+        dst = numpy.frombuffer(out, numpy.uint8)
+        for i in range(0, size, IG_CHUNK):
+            n = min(IG_CHUNK, size - i)
+            numpy.bitwise_xor(src[i:i+n], key[:n], out=dst[i:i+n])
+        return out
+    src = memoryview(data)
+    dst = memoryview(out)
+    for i in range(0, size, IG_CHUNK):
+        n = min(IG_CHUNK, size - i)
+        if n < IG_CHUNK:
+            key &= (1 << (n * 8)) - 1
+        value = int.from_bytes(src[i:i+n], 'little') ^ key
+        dst[i:i+n] = value.to_bytes(n, 'little')
+    return out
+
+
 def ig_transform_data(data, xor=0x00):
-    return bytearray(
-        (data[i] ^ (i + 2) ^ xor) & 0xFF
-        for i in range(len(data))
-    )
+    return ig_transform_into(data, bytearray(len(data)), xor)
 
 
-def iga_create(files, xor=0x00, name_encoding='ascii'):
+IGA_HEADER = b'IGA0' + b'\0' * 4 + b'\2\0\0\0' * 2
+
+
+def iga_header(entries, name_encoding='ascii'):
+    # entries: (name, size) pairs, in archive order
     descs = bytearray()
     names = bytearray()
-    datas = bytearray()
-    fn_beg = 0
-    for name, data in files:
+    fn_beg = dt_beg = 0
+    for name, size in entries:
         name = name.encode(name_encoding)
-        data = ig_transform_data(data, xor)
-        # append to three blocks
+        # append to two blocks
         descs += ig_encode(fn_beg)
-        descs += ig_encode(len(datas))
-        descs += ig_encode(len(data))
+        descs += ig_encode(dt_beg)
+        descs += ig_encode(size)
         names += ig_encode_data(name)
-        datas += data
-        # update fn beg
+        # update fn beg and data beg
         fn_beg = fn_beg + len(name)
+        dt_beg = dt_beg + size
     return b''.join((
-        b'IGA0' + b'\0' * 4 + b'\2\0\0\0' * 2,
+        IGA_HEADER,
         ig_encode(len(descs)), descs,
         ig_encode(len(names)), names,
-        datas,
     ))
+
+
+def iga_create(files, xor=0x00, name_encoding='ascii'):
+    files = list(files)
+    header = iga_header(
+        ((name, len(data)) for name, data in files), name_encoding)
+    return b''.join([header] + [
+        ig_transform_data(data, xor) for _, data in files
+    ])
+
+
+class IgaWriter:
+    def __init__(self, fp, xor=0x00, name_encoding='ascii',
+                 chunk_size=IG_CHUNK * 16):
+        self.fp = fp
+        self.xor = xor
+        self.name_encoding = name_encoding
+        self.chunk_size = chunk_size
+        self.buffer = None
+
+    @staticmethod
+    def source_size(source):
+        if isinstance(source, (str, os.PathLike)):
+            return os.path.getsize(source)
+        if hasattr(source, 'read'):
+            pos = source.tell()
+            size = source.seek(0, os.SEEK_END) - pos
+            source.seek(pos)
+            return size
+        return memoryview(source).nbytes
+
+    def write(self, files):
+        # files: (name, source) pairs, source is a path, a binary stream
+        # or a bytes-like object; only one chunk is held in memory at once
+        files = list(files)
+        sizes = [self.source_size(source) for _, source in files]
+        self.fp.write(iga_header(
+            ((name, size) for (name, _), size in zip(files, sizes)),
+            self.name_encoding))
+        for (name, source), size in zip(files, sizes):
+            self.write_entry(name, source, size)
+        return sum(sizes)
+
+    def write_entry(self, name, source, size):
+        # write one payload of an already written header
+        if self.buffer is None:
+            self.buffer = memoryview(bytearray(self.chunk_size))
+        if isinstance(source, (str, os.PathLike)):
+            with open(source, 'rb') as fp:
+                written = self._write_stream(fp, size, self.buffer)
+        elif hasattr(source, 'read'):
+            written = self._write_stream(source, size, self.buffer)
+        else:
+            written = self._write_buffer(memoryview(source), self.buffer)
+        if written != size:
+            raise ValueError('size of %s changed while writing' % name)
+
+    def _write_stream(self, fp, size, buffer):
+        pos = 0
+        while pos < size:
+            n = fp.readinto(buffer[:min(len(buffer), size - pos)])
+            if not n:
+                break
+            ig_transform_into(buffer[:n], buffer, self.xor, pos)
+            self.fp.write(buffer[:n])
+            pos += n
+        return pos
+
+    def _write_buffer(self, data, buffer):
+        data = data.cast('B')
+        for pos in range(0, len(data), len(buffer)):
+            n = min(len(buffer), len(data) - pos)
+            ig_transform_into(data[pos:pos+n], buffer, self.xor, pos)
+            self.fp.write(buffer[:n])
+        return len(data)
+
+
+class IgaArchive:
+    def __init__(self, path, xor=0x00, name_encoding='ascii'):
+        self.path = path
+        self.xor = xor
+        self.name_encoding = name_encoding
+        with open(path, 'rb') as fp:
+            self.mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self.entries = self._read_index()
+        except Exception:
+            self.mmap.close()
+            raise
+
+    def _read_index(self):
+        data = self.mmap
+        if data[:4] != b'IGA0':
+            raise ValueError('not an IGA archive')
+        desc_len, offset = ig_decode(data, 16)
+        desc_end = offset + desc_len
+        descs = iter(ig_decode_list(data, offset, desc_end))
+        descs = list(zip(descs, descs, descs))
+        name_len, offset = ig_decode(data, desc_end)
+        name_end = offset + name_len
+        names = ig_decode_data(data, offset, name_end)
+        entries = {}
+        fn_ends = [fn_beg for fn_beg, _, _ in descs[1:]] + [len(names)]
+        for (fn_beg, dt_beg, dt_len), fn_end in zip(descs, fn_ends):
+            name = names[fn_beg:fn_end].decode(self.name_encoding)
+            entries[name] = (name_end + dt_beg, dt_len)
+        return entries
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.entries)
+
+    def __contains__(self, name):
+        return name in self.entries
+
+    def __getitem__(self, name):
+        return self.read(name)
+
+    def close(self):
+        self.mmap.close()
+
+    def raw(self, name):
+        offset, length = self.entries[name]
+        return memoryview(self.mmap)[offset:offset+length]
+
+    def read(self, name):
+        return ig_transform_data(self.raw(name), self.xor)
+
+
+def _iga_copy_range(src_fp, dst_fp, offset, length):
+    # copy already transformed bytes, in kernel space when possible
+    try:
+        src_fd, dst_fd = src_fp.fileno(), dst_fp.fileno()
+    except (AttributeError, OSError):
+        src_fd = dst_fd = None
+    if dst_fd is not None:
+        dst_fp.flush()
+        for copy in (getattr(os, 'copy_file_range', None),
+                     getattr(os, 'sendfile', None)):
+            if copy is None:
+                continue
+            try:
+                while length > 0:
+                    if copy is os.sendfile:
+                        n = copy(dst_fd, src_fd, offset, length)
+                    else:
+                        n = copy(src_fd, dst_fd, length, offset)
+                    if n == 0:
+                        break
+                    offset += n
+                    length -= n
+            except OSError:
+                continue
+            if length == 0:
+                return
+    src_fp.seek(offset)
+    while length > 0:
+        n = min(length, IG_CHUNK * 16)
+        data = src_fp.read(n)
+        if len(data) != n:
+            raise ValueError('archive is truncated')
+        dst_fp.write(data)
+        length -= n
+
+
+def iga_update(old_archive, replacements, out):
+    # old_archive: an IgaArchive, replacements: {name: source} as for
+    # IgaWriter, out: a binary file; replaced entries keep their place,
+    # new ones are appended; untouched entries are copied without decoding
+    writer = IgaWriter(out, old_archive.xor, old_archive.name_encoding)
+    replacements = dict(replacements)
+    entries = []
+    for name, (offset, length) in old_archive.entries.items():
+        if name in replacements:
+            source = replacements.pop(name)
+            entries.append((name, writer.source_size(source), source))
+        else:
+            entries.append((name, length, offset))
+    for name, source in replacements.items():
+        entries.append((name, writer.source_size(source), source))
+    out.write(iga_header(
+        ((name, size) for name, size, _ in entries),
+        old_archive.name_encoding))
+    with open(old_archive.path, 'rb', buffering=0) as src_fp:
+        run_beg = run_len = 0
+        for name, size, source in entries:
+            if isinstance(source, int):
+                # coalesce adjacent untouched entries into one copy
+                if run_len and run_beg + run_len == source:
+                    run_len += size
+                    continue
+                if run_len:
+                    _iga_copy_range(src_fp, out, run_beg, run_len)
+                run_beg, run_len = source, size
+                continue
+            if run_len:
+                _iga_copy_range(src_fp, out, run_beg, run_len)
+                run_len = 0
+            writer.write_entry(name, source, size)
+        if run_len:
+            _iga_copy_range(src_fp, out, run_beg, run_len)
+
+
+def iga_entry_path(directory, name):
+    path = os.path.normpath(name.replace('\\', '/'))
+    if os.path.isabs(path) or path.split(os.sep)[0] == os.pardir:
+        raise ValueError('unsafe entry name %r' % name)
+    return os.path.join(directory, path)
+
+
+def _iga_extract_part(path, xor, directory, entries, chunk_size=IG_CHUNK * 16):
+    # runs in a worker: maps the archive itself, only names and offsets
+    # are sent over from the parent process
+    size = 0
+    buffer = memoryview(bytearray(chunk_size))
+    with open(path, 'rb') as fp:
+        data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    with data, memoryview(data) as view:
+        for name, offset, length in entries:
+            out_path = iga_entry_path(directory, name)
+            os.makedirs(os.path.dirname(out_path), exist_ok=True)
+            with open(out_path, 'wb') as fo:
+                for pos in range(0, length, chunk_size):
+                    n = min(chunk_size, length - pos)
+                    beg = offset + pos
+                    ig_transform_into(view[beg:beg+n], buffer, xor, pos)
+                    fo.write(buffer[:n])
+            size += length
+    return len(entries), size
+
+
+def iga_extract(path, directory, xor=0x00, name_encoding='ascii',
+                names=None, workers=None, progress=None):
+    # progress(done_files, total_files, done_bytes, total_bytes)
+    # returns (files, bytes, seconds)
+    beg = time.perf_counter()
+    with IgaArchive(path, xor, name_encoding) as arc:
+        if names is None:
+            names = list(arc)
+        entries = [(name,) + arc.entries[name] for name in names]
+    for name, _, _ in entries:
+        iga_entry_path(directory, name)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    total_size = sum(length for _, _, length in entries)
+    # several parts per worker, of about equal size, for load balancing
+    parts = []
+    part_size = total_size // (workers * 4) + 1
+    for entry in entries:
+        if not parts or parts[-1][0] >= part_size:
+            parts.append([0, []])
+        parts[-1][0] += entry[2]
+        parts[-1][1].append(entry)
+    done_files = done_size = 0
+    if progress is not None:
+        progress(done_files, len(entries), done_size, total_size)
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        futures = [
+            executor.submit(_iga_extract_part, path, xor, directory, part)
+            for _, part in parts
+        ]
+        for future in concurrent.futures.as_completed(futures):
+            files, size = future.result()
+            done_files += files
+            done_size += size
+            if progress is not None:
+                progress(done_files, len(entries), done_size, total_size)
+    return done_files, done_size, time.perf_counter() - beg
@@ -0,0 +1,159 @@
+#!/bin/env python3
+import json
+import os
+
+from . import batch, flowerscript, igarchive
+
+# op name: (asset kind, extension the game appends to the name)
+ASSETS = {
+    'jmp_script': ('script', ''),
+    'bg_0f': ('bg', ''),
+    'bg_10': ('bg', ''),
+    'fg_12': ('fg', ''),
+    'fg_9c': ('fg', ''),
+    'fg_avatar': ('fg', ''),
+    'bgm_play': ('bgm', '.ogg'),
+    'bgm_fadein': ('bgm', '.ogg'),
+    'se_play': ('se', '.ogg'),
+    'se_fadein': ('se', '.ogg'),
+    'v_play': ('voice', '.ogg'),
+}
+
+# asset kind: archive in the game directory
+ARCHIVES = {
+    'script': 'script.iga',
+    'bg': 'bgimage.iga',
+    'fg': 'fgimage.iga',
+    'bgm': 'bgm.iga',
+    'se': 'se.iga',
+    'voice': 'voice.iga',
+}
+
+
+def script_assets(source, encoding, videos=None):
+    # references of one script: [(kind, asset name, offset, op name)];
+    # play_video takes a number, videos: {number: file name}, numbers not
+    # in it are named '#<number>'
+    refs = []
+    for ins in flowerscript.iter_decode(batch.read_source(source), encoding):
+        opname = ins.op.opname
+        if opname in ASSETS:
+            if ins.string:
+                kind, ext = ASSETS[opname]
+                refs.append((kind, ins.string + ext, ins.offset, opname))
+        elif opname == 'play_video':
+            number = ins.args[1]
+            name = (videos or {}).get(number, '#%d' % number)
+            refs.append(('video', name, ins.offset, opname))
+    return refs
+
+
+def assets_one(source, encoding, videos=None):
+    # for batch.run
+    return script_assets(source, encoding, videos), False
+
+
+def asset_names(source):
+    # source: an IgaArchive, a path to an archive or a directory, or any
+    # iterable of names
+    if isinstance(source, str):
+        if os.path.isdir(source):
+            return sorted(os.listdir(source))
+        with igarchive.IgaArchive(source) as archive:
+            return list(archive)
+    return list(source)
+
+
+def game_assets(directory):
+    # {kind: archive path} of the ARCHIVES found in directory
+    return {
+        kind: os.path.join(directory, name)
+        for kind, name in ARCHIVES.items()
+        if os.path.isfile(os.path.join(directory, name))
+    }
+
+
+class Manifest:
+    # referenced names joined against the asset names of each kind; names
+    # are compared case-insensitively
+    def __init__(self):
+        self.references = {}  # kind: {name: [(script, offset, op)]}
+        self.assets = {}      # kind: {lower case name: name}
+
+    def add_script(self, script, refs):
+        for kind, name, offset, opname in refs:
+            self.references.setdefault(kind, {}) \
+                .setdefault(name, []).append((script, offset, opname))
+
+    def add_assets(self, kind, names):
+        index = self.assets.setdefault(kind, {})
+        for name in names:
+            index[name.lower()] = name
+
+    def missing(self):
+        # {kind: {name: sites}} of the references no asset of their kind
+        # matches; kinds without assets are not checked
+        result = {}
+        for kind, names in self.references.items():
+            if kind not in self.assets:
+                continue
+            index = self.assets[kind]
+            missing = {
+                name: sites for name, sites in sorted(names.items())
+                if name.lower() not in index
+            }
+            if missing:
+                result[kind] = missing
+        return result
+
+    def orphans(self):
+        # {kind: [name]} of the assets no script refers to
+        result = {}
+        for kind, index in self.assets.items():
+            used = {name.lower() for name in self.references.get(kind, ())}
+            orphans = sorted(
+                name for lower, name in index.items() if lower not in used)
+            if orphans:
+                result[kind] = orphans
+        return result
+
+    def to_json(self):
+        return {
+            'references': {
+                kind: {name: sites for name, sites in sorted(names.items())}
+                for kind, names in sorted(self.references.items())
+            },
+            'missing': self.missing(),
+            'orphans': self.orphans(),
+        }
+
+    def save(self, fp):
+        json.dump(self.to_json(), fp, ensure_ascii=False,
+                  separators=(',', ':'))
+
+
+def build_manifest(scripts, assets=None, encoding=flowerscript.ENCODING,
+                   xor=0xFF, workers=None, videos=None, report=None):
+    # scripts: an IgaArchive, or a path to an archive or a directory;
+    # assets: {kind: asset_names source}, e.g. game_assets(directory);
+    # scripts are decoded in parallel, report(name, seconds, result, error)
+    # is called as each one finishes and failed ones are left out, without
+    # report the first failure raises ValueError
+    manifest = Manifest()
+    for kind, source in (assets or {}).items():
+        manifest.add_assets(kind, asset_names(source))
+    jobs = [
+        (batch.source_name(source), source, encoding, videos)
+        for source in batch.archive_sources(scripts, xor)
+    ]
+    refs = {}
+    for name, _, result, error in batch.run(assets_one, jobs, workers, report):
+        if error == None:
+            refs[name] = result[0]
+        elif report == None:
+            raise ValueError('%s: %s' % (name, error))
+    # in archive order, whatever order the workers finished in
+    for name, *_ in jobs:
+        if name in refs:
+            manifest.add_script(name, refs[name])
+    return manifest
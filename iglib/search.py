@@ -0,0 +1,366 @@
+#!/bin/env python3
+import array
+import bisect
+import concurrent.futures
+import hashlib
+import json
+import mmap
+import os
+import re
+import struct
+import sys
+import tempfile
+import unicodedata
+
+from . import batch, flowerscript
+
+# bump when the file layout or the tokenizer changes
+VERSION = 1
+MAGIC = b'IGS\0'
+HEADER = struct.Struct('<4sII')  # magic, version, length of the meta json
+
+# ops whose string is the name of a file in another archive
+RESOURCE_OPS = (
+    'jmp_script', 'bg_0f', 'bg_10', 'fg_12', 'fg_9c', 'fg_avatar',
+    'bgm_play', 'bgm_fadein', 'se_play', 'se_fadein', 'v_play',
+)
+
+_CJK = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff'
+_TOKENS = re.compile('([%s]+)|([^\\W%s]+)' % (_CJK, _CJK))
+
+
+def normalize(text):
+    # full / half width forms and case are not significant
+    return unicodedata.normalize('NFKC', text).casefold()
+
+
+def index_terms(text):
+    # every suffix of a word, CJK runs as bigrams plus their last character,
+    # so that any part of a word or any single character is found as a
+    # prefix of a term
+    terms = set()
+    for cjk, word in _TOKENS.findall(normalize(text)):
+        if word:
+            terms.update(word[i:] for i in range(len(word)))
+            continue
+        terms.update(cjk[i:i+2] for i in range(len(cjk) - 1))
+        terms.add(cjk[-1])
+    return terms
+
+
+def query_terms(text):
+    # (term, whether it matches as a prefix)
+    terms = []
+    for cjk, word in _TOKENS.findall(text):
+        if word:
+            terms.append((word, True))
+        elif len(cjk) == 1:
+            terms.append((cjk, True))
+        else:
+            terms.extend((cjk[i:i+2], False) for i in range(len(cjk) - 1))
+    return terms
+
+
+def _digest(xor, data):
+    return hashlib.blake2b(bytes([xor]) + data, digest_size=16).hexdigest()
+
+
+def source_digest(source, archive):
+    # of the stored bytes, an entry of archive (an IgaArchive) is hashed
+    # without decoding it
+    path, xor, name = source
+    if path == None:
+        with open(name, 'rb') as fp:
+            return _digest(xor, fp.read())
+    with archive.raw(name) as raw:
+        return _digest(xor, raw)
+
+
+def script_entries(source, encoding):
+    # sites of one script: [(offset, opcode, text)], {term: [site index]}
+    # and the digest of the bytes they were decoded from
+    path, xor, name = source
+    if path == None:
+        with open(name, 'rb') as fp:
+            data = fp.read()
+        digest = _digest(xor, data)
+    else:
+        archive = batch.open_archive(path, xor)
+        digest = source_digest(source, archive)
+        data = archive.read(name)
+    sites = []
+    terms = {}
+    for ins in flowerscript.iter_decode(data, encoding):
+        if ins.string == None:
+            continue
+        for term in index_terms(ins.string):
+            terms.setdefault(term, []).append(len(sites))
+        sites.append((ins.offset, ins.opcode, ins.string))
+    return batch.source_name(source), sites, terms, digest
+
+
+def _u32(values):
+    data = array.array('I', values)
+    if sys.byteorder != 'little':
+        data.byteswap()
+    return data.tobytes()
+
+
+def _u32_view(view):
+    # the u32 arrays as written by _u32, mapped as is on little-endian hosts
+    # and copied and swapped on the others
+    if sys.byteorder == 'little':
+        return view.cast('I')
+    data = array.array('I', view.tobytes())
+    data.byteswap()
+    return data
+
+
+def _pad(data):
+    return data + bytes(-len(data) % 4)
+
+
+class _Terms:
+    # the sorted term table as a sequence of bytes, for bisect
+    def __init__(self, blob, ends):
+        self.blob = blob
+        self.ends = ends
+
+    def __len__(self):
+        return len(self.ends)
+
+    def __getitem__(self, i):
+        beg = self.ends[i-1] if i else 0
+        return self.blob[beg:self.ends[i]].tobytes()
+
+
+class SearchIndex:
+    # a memory-mapped index file written by build_search_index; after the
+    # header and the meta json (encoding, scripts with their digests and
+    # site ranges, section sizes) come little-endian u32 arrays:
+    #   sites      (script, offset, opcode, end of its text) per site
+    #   texts      utf-8 strings of the sites
+    #   term ends  end of each term in the term blob, terms are sorted
+    #   post ends  end of each term's site ids in postings
+    #   term blob  utf-8 terms
+    #   postings   site ids, ascending per term
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as fp:
+            self.mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, size = HEADER.unpack_from(self.mmap)
+        if magic != MAGIC or version != VERSION:
+            self.mmap.close()
+            raise ValueError('%s: not a search index of version %d' % (
+                path, VERSION))
+        pos = HEADER.size
+        meta = json.loads(self.mmap[pos:pos+size].decode('utf-8'))
+        pos += size + (-size % 4)
+        self.encoding = meta['encoding']
+        self.names = [script[0] for script in meta['scripts']]
+        # name: (digest, first site, number of sites)
+        self.scripts = {
+            name: (digest, first, count)
+            for name, digest, first, count in meta['scripts']
+        }
+        view = memoryview(self.mmap)
+        sections = []
+        for size in meta['sections']:
+            sections.append(view[pos:pos+size])
+            pos += size + (-size % 4)
+        sites, self.texts, term_ends, post_ends, term_blob, postings = sections
+        self.sites = _u32_view(sites)
+        self.post_ends = _u32_view(post_ends)
+        self.postings = _u32_view(postings)
+        self.terms = _Terms(term_blob, _u32_view(term_ends))
+
+    def close(self):
+        self.terms = self.sites = self.post_ends = self.postings = None
+        self.texts = None
+        self.mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.sites) // 4
+
+    def site(self, i):
+        # (script, offset, opcode, text)
+        script, offset, opcode, end = self.sites[i*4:i*4+4]
+        beg = self.sites[i*4-1] if i else 0
+        return (self.names[script], offset, opcode,
+                self.texts[beg:end].tobytes().decode('utf-8'))
+
+    def text(self, i):
+        beg = self.sites[i*4-1] if i else 0
+        return self.texts[beg:self.sites[i*4+3]].tobytes().decode('utf-8')
+
+    def _postings(self, i):
+        beg = self.post_ends[i-1] if i else 0
+        return self.postings[beg:self.post_ends[i]]
+
+    def lookup(self, term, prefix=False):
+        # site ids of a term, or of every term starting with it
+        key = term.encode('utf-8')
+        lo = bisect.bisect_left(self.terms, key)
+        if not prefix:
+            if lo < len(self.terms) and self.terms[lo] == key:
+                return set(self._postings(lo))
+            return set()
+        hi = bisect.bisect_left(self.terms, key + b'\xff', lo)
+        ids = set()
+        for i in range(lo, hi):
+            ids.update(self._postings(i))
+        return ids
+
+    def search(self, query, ops=None, script=None):
+        # sites whose string contains query, as (script, offset, opcode,
+        # text) in script and offset order; ops: op names to keep
+        needle = normalize(query)
+        candidates = None
+        for term, prefix in query_terms(needle):
+            ids = self.lookup(term, prefix)
+            candidates = ids if candidates == None else candidates & ids
+            if not candidates:
+                return []
+        if script != None:
+            if script not in self.scripts:
+                return []
+            _, first, count = self.scripts[script]
+            scope = range(first, first + count)
+            candidates = scope if candidates == None else \
+                candidates.intersection(scope)
+        elif candidates == None:
+            candidates = range(len(self))
+        opcodes = None
+        if ops != None:
+            opcodes = {
+                opcode for opcode, op in flowerscript.OPS.items()
+                if op.opname in ops
+            }
+        result = []
+        for i in sorted(candidates):
+            if opcodes != None and self.sites[i*4+2] not in opcodes:
+                continue
+            if needle in normalize(self.text(i)):
+                result.append(self.site(i))
+        return result
+
+    def resources(self, name):
+        # where a file name (or a part of it) is used by RESOURCE_OPS
+        return self.search(name, RESOURCE_OPS)
+
+
+def _write_index(path, encoding, scripts, sites, postings):
+    # scripts: [(name, digest, first, count)], sites: [(script index,
+    # offset, opcode, text)], postings: {term: [site id]}
+    texts = bytearray()
+    table = []
+    for script, offset, opcode, text in sites:
+        texts += text.encode('utf-8')
+        table.extend((script, offset, opcode, len(texts)))
+    term_blob = bytearray()
+    term_ends = []
+    post_ends = []
+    ids = []
+    for term in sorted(postings, key=lambda t: t.encode('utf-8')):
+        term_blob += term.encode('utf-8')
+        term_ends.append(len(term_blob))
+        ids.extend(sorted(postings[term]))
+        post_ends.append(len(ids))
+    sections = [_u32(table), bytes(texts), _u32(term_ends), _u32(post_ends),
+                bytes(term_blob), _u32(ids)]
+    meta = json.dumps({
+        'encoding': encoding,
+        'scripts': scripts,
+        'sections': [len(section) for section in sections],
+    }, ensure_ascii=False).encode('utf-8')
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(HEADER.pack(MAGIC, VERSION, len(meta)))
+            fp.write(_pad(meta))
+            for section in sections:
+                fp.write(_pad(section))
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+
+
+def _open_previous(path, encoding):
+    try:
+        index = SearchIndex(path)
+    except (OSError, ValueError):
+        return None
+    if index.encoding != encoding:
+        index.close()
+        return None
+    return index
+
+
+def build_search_index(archive, path, encoding=flowerscript.ENCODING,
+                       xor=0xFF, workers=None):
+    # archive: an IgaArchive, or a path to an archive or a directory;
+    # scripts whose digest did not change since the index at path was
+    # written are taken from it, the others are decoded in parallel and
+    # stored with the digest the workers computed of what they decoded;
+    # returns (SearchIndex, number of scripts reused, number decoded)
+    if isinstance(archive, str) and not os.path.isdir(archive):
+        archive = batch.open_archive(archive, xor)
+    sources = batch.archive_sources(archive, xor)
+    digests = [source_digest(source, archive) for source in sources]
+    old = _open_previous(path, encoding)
+    fresh = [
+        source for source, digest in zip(sources, digests)
+        if old == None or old.scripts.get(batch.source_name(source),
+                                          (None,))[0] != digest
+    ]
+    decoded = {}
+    if fresh:
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            for name, sites, terms, digest in executor.map(
+                    script_entries, fresh, [encoding] * len(fresh),
+                    chunksize=8):
+                decoded[name] = sites, terms, digest
+    scripts = []
+    sites = []
+    postings = {}
+    moved = None  # old site id: new site id, -1 for the dropped ones
+    for index, (source, digest) in enumerate(zip(sources, digests)):
+        name = batch.source_name(source)
+        first = len(sites)
+        if name in decoded:
+            script_sites, terms, digest = decoded[name]
+            sites.extend(
+                (index, offset, opcode, text)
+                for offset, opcode, text in script_sites)
+            for term, ids in terms.items():
+                postings.setdefault(term, []).extend(i + first for i in ids)
+        else:
+            _, old_first, count = old.scripts[name]
+            if moved == None:
+                moved = array.array('q', [-1]) * len(old)
+            moved[old_first:old_first+count] = array.array(
+                'q', range(first, first + count))
+            sites.extend(
+                (index,) + old.site(i)[1:]
+                for i in range(old_first, old_first + count))
+        scripts.append((name, digest, first, len(sites) - first))
+    if moved != None:
+        # postings of the reused scripts, with their site ids moved
+        for i in range(len(old.terms)):
+            ids = [moved[site] for site in old._postings(i)
+                   if moved[site] != -1]
+            if ids:
+                postings.setdefault(
+                    old.terms[i].decode('utf-8'), []).extend(ids)
+    if old != None:
+        old.close()
+    _write_index(path, encoding, scripts, sites, postings)
+    return SearchIndex(path), len(sources) - len(fresh), len(fresh)
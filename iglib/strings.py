@@ -0,0 +1,104 @@
+#!/bin/env python3
+import concurrent.futures
+import csv
+import json
+
+from . import batch, flowerscript
+
+FIELDS = ('script', 'offset', 'op', 'text', 'tail')
+
+
+def script_strings(source, encoding):
+    # rows of one script: (script, offset, op, text, tail as hex)
+    name = batch.source_name(source)
+    return [
+        (name, ins.offset, ins.op.opname, ins.string,
+         ins.tail.hex() if ins.tail != None else '')
+        for ins in flowerscript.iter_decode(batch.read_source(source), encoding)
+        if ins.string != None
+    ]
+
+
+def extract_strings(archive, fp, fmt='jsonl', encoding=flowerscript.ENCODING,
+                    xor=0xFF, workers=None):
+    # writes rows to the text file fp, in archive order, as each script is
+    # done; fmt: 'jsonl' or 'csv'; returns the number of rows
+    sources = batch.archive_sources(archive, xor)
+    count = 0
+    if fmt == 'csv':
+        writer = csv.writer(fp)
+        writer.writerow(FIELDS)
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        for rows in executor.map(
+                script_strings, sources, [encoding] * len(sources),
+                chunksize=8):
+            for row in rows:
+                if fmt == 'csv':
+                    writer.writerow(row[:1] + ('0x%x' % row[1],) + row[2:])
+                else:
+                    fp.write(json.dumps(
+                        dict(zip(FIELDS, row)), ensure_ascii=False) + '\n')
+            count += len(rows)
+    return count
+
+
+def read_strings(fp, fmt='jsonl'):
+    # rows written by extract_strings, possibly with edited text
+    if fmt == 'csv':
+        for row in csv.DictReader(fp):
+            yield (row['script'], int(row['offset'], 0), row['op'],
+                   row['text'], row['tail'])
+        return
+    for line in fp:
+        if line.strip():
+            row = json.loads(line)
+            yield tuple(row[k] for k in FIELDS)
+
+
+def inject_script(source, changes, encoding, out_encoding=None):
+    # changes: {offset: (op, text, tail as hex)}, returns the new script
+    # assembled with out_encoding (default: encoding)
+    instructions = flowerscript.decode(batch.read_source(source), encoding)
+    found = 0
+    for ins in instructions:
+        if ins.offset not in changes:
+            continue
+        opname, text, tail = changes[ins.offset]
+        if ins.string == None or ins.op.opname != opname:
+            raise ValueError('%s: no %s string at offset 0x%x' % (
+                batch.source_name(source), opname, ins.offset))
+        ins.string = text
+        ins.tail = bytes.fromhex(tail) if tail else None
+        found += 1
+    if found != len(changes):
+        raise ValueError('%s: %d rows do not match an instruction' % (
+            batch.source_name(source), len(changes) - found))
+    # labels follow their instructions, string lengths are recomputed
+    return bytes(flowerscript.Assembler.from_records(
+        instructions, out_encoding or encoding).bytes)
+
+
+def inject_strings(archive, rows, encoding=flowerscript.ENCODING, xor=0xFF,
+                   workers=None, out_encoding=None):
+    # rows: (script, offset, op, text, tail) as from read_strings; returns
+    # {script: new data} for the scripts that have rows, e.g. for
+    # igarchive.iga_update; out_encoding: e.g. 'gbk' for a translation
+    changes = {}
+    for script, offset, opname, text, tail in rows:
+        changes.setdefault(script, {})[offset] = (opname, text, tail)
+    sources = [
+        source for source in batch.archive_sources(archive, xor)
+        if batch.source_name(source) in changes
+    ]
+    missing = set(changes) - set(map(batch.source_name, sources))
+    if missing:
+        raise KeyError('scripts not found: %s' % ', '.join(sorted(missing)))
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        datas = executor.map(
+            inject_script, sources,
+            [changes[batch.source_name(source)] for source in sources],
+            [encoding] * len(sources), [out_encoding] * len(sources))
+        return {
+            batch.source_name(source): data
+            for source, data in zip(sources, datas)
+        }
@@ -12,5 +12,8 @@ setup(
     url='https://github.com/shimamura-sakura/FlowerScript',
     license='MIT',
     packages=['iglib'],
+    entry_points={
+        'console_scripts': ['iglib = iglib.__main__:main'],
+    },
     python_requires='>=3.2',
 )
\ No newline at end of file
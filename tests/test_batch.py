@@ -0,0 +1,35 @@
+#!/bin/env python3
+import io
+import json
+import os
+
+from iglib import batch, flowerscript, igarchive, strings
+
+
+def script(text):
+    s = flowerscript.Assembler()
+    s.op('dlg_str', 0, text)
+    s.op('exit', 0)
+    return bytes(s.bytes)
+
+
+def replace_archive(path, files):
+    # written next to it and renamed over it, as iglib asm does
+    with open(str(path) + '.tmp', 'wb') as fp:
+        fp.write(igarchive.iga_create(files, 0xFF))
+    os.replace(str(path) + '.tmp', path)
+
+
+def texts(path):
+    fp = io.StringIO()
+    strings.extract_strings(str(path), fp, workers=1)
+    return [json.loads(line)['text'] for line in fp.getvalue().splitlines()]
+
+
+def test_rewritten_archive_is_mapped_again(tmp_path):
+    path = tmp_path / 'st.iga'
+    replace_archive(path, [('a.s', script('あいう'))])
+    assert texts(path) == ['あいう']
+    replace_archive(path, [('a.s', script('かき')), ('b.s', script('く'))])
+    assert texts(path) == ['かき', 'く']
+    assert batch.read_source((str(path), 0xFF, 'b.s')) == script('く')
@@ -0,0 +1,23 @@
+#!/bin/env python3
+from iglib import cache
+
+
+def stored_size(directory):
+    return sum(size for _, size, _ in cache.Cache(directory).entries())
+
+
+def test_overwrite_does_not_grow_estimate(tmp_path):
+    store = cache.Cache(str(tmp_path), max_size=1 << 20)
+    for _ in range(10):
+        store.put('ab' * 32, bytes(1000))
+    assert store.size == stored_size(str(tmp_path)) == 1000
+
+
+def test_shared_directory_stays_near_limit(tmp_path):
+    # workers of one batch each keep their own estimate
+    max_size = 64 << 10
+    stores = [cache.Cache(str(tmp_path), max_size) for _ in range(4)]
+    for i in range(400):
+        stores[i % len(stores)].put('%064x' % i, bytes(1000))
+        assert stored_size(str(tmp_path)) <= \
+            max_size + len(stores) * (max_size // cache.RESCAN + 1000)
@@ -0,0 +1,28 @@
+#!/bin/env python3
+import io
+
+from iglib import cfg, flowerscript
+
+
+def script(*ops):
+    s = flowerscript.Assembler()
+    for op in ops:
+        s.op(*op)
+    s.op('exit', 0)
+    return bytes(s.bytes)
+
+
+def test_callees_match_names_case_insensitively():
+    archive = {
+        'start.s': script(('jmp_script', 0, 'ROUTE_A.S'),
+                          ('jmp_script', 0, 'route_a.s')),
+        'route_a.s': script(('mark_end', 1)),
+    }
+    index = cfg.build_index(archive)
+    assert index.calls['start.s'] == ['route_a.s']
+    assert index.callers_of('route_a.s') == ['start.s']
+    assert index.can_reach('start.s', 1)
+    fp = io.StringIO()
+    index.save(fp)
+    fp.seek(0)
+    assert cfg.XrefIndex.load(fp).reaching(1) == ['route_a.s', 'start.s']
@@ -0,0 +1,17 @@
+#!/bin/env python3
+from iglib import __main__, flowerscript
+
+
+def test_options_after_command(tmp_path):
+    s = flowerscript.Assembler('gbk')
+    s.op('dlg_str', 0, '中文')
+    s.op('exit', 0)
+    (tmp_path / 'a.s').write_bytes(bytes(s.bytes))
+    for argv in (['-e', 'gbk', '-j', '1', 'verify', str(tmp_path)],
+                 ['verify', str(tmp_path), '-e', 'gbk', '-j', '1'],
+                 ['-e', 'cp932', 'verify', str(tmp_path), '-e', 'gbk']):
+        assert __main__.main(argv) == 0, argv
+    out = tmp_path / 'out'
+    assert __main__.main(['dis', str(tmp_path), str(out), '-e', 'gbk',
+                          '-j', '1']) == 0
+    assert '中文' in (out / 'a.s.py').read_text('utf-8')
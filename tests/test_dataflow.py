@@ -0,0 +1,72 @@
+#!/bin/env python3
+import io
+
+from iglib import dataflow, flowerscript
+
+
+def script(*ops):
+    s = flowerscript.Assembler()
+    for op in ops:
+        s.op(*op)
+    s.op('exit', 0)
+    s.finish()
+    return flowerscript.decode(bytes(s.bytes))
+
+
+def test_read_and_write_arguments():
+    # distinct values in every field, only the address and value are kept
+    ops = [('val_set', 0x64, -5), ('val_add', 0x65, 7)] + [
+        (opname, [0x11, 0x12], 0x66 + i, [0x13, 0x14], 0x100 + i, 0)
+        for i, opname in enumerate(['jmp_eq', 'jmp_be', 'jmp_le'])
+    ]
+    index = dataflow.VarIndex()
+    index.update('a.s', script(*ops))
+    assert index.writes(0x64) == [('a.s', 0, 'val_set', -5)]
+    assert index.writes(0x65) == [('a.s', 8, 'val_add', 7)]
+    for i, opname in enumerate(['jmp_eq', 'jmp_be', 'jmp_le']):
+        assert index.reads(0x66 + i) == [
+            ('a.s', 16 + 16 * i, opname, 0x100 + i)]
+        assert index.writes(0x66 + i) == []
+    assert sorted(index.addresses) == [0x64, 0x65, 0x66, 0x67, 0x68]
+
+
+def test_update_and_remove():
+    index = dataflow.VarIndex()
+    index.update('a.s', script(('val_set', 0x64, 1), ('val_set', 0x70, 2)))
+    index.update('b.s', script(('jmp_eq', [0, 0], 0x64, [0, 0], 1, 0)))
+    assert index.sites(0x64) == [('a.s', 0, 'val_set', 1),
+                                 ('b.s', 0, 'jmp_eq', 1)]
+    # the sites of a.s are replaced, 0x70 is no longer touched
+    index.update('a.s', script(('val_add', 0x71, 3), ('val_add', 0x64, 4)))
+    assert index.writes(0x64) == [('a.s', 8, 'val_add', 4)]
+    assert index.reads(0x64) == [('b.s', 0, 'jmp_eq', 1)]
+    assert 0x70 not in index.addresses
+    assert index.writes(0x71, 'a.s') == [('a.s', 0, 'val_add', 3)]
+    index.remove('b.s')
+    assert index.reads(0x64) == []
+    assert index.writes(0x64) == [('a.s', 8, 'val_add', 4)]
+    index.remove('a.s')
+    assert index.addresses == {} and index.scripts == {}
+    index.remove('missing.s')
+
+
+def test_save_load():
+    archive = {
+        'a.s': bytes(flowerscript.Assembler.from_records(script(
+            ('val_set', 0x64, -1), ('jmp_le', [0, 0], 0x65, [0, 0], 2, 0)
+        )).bytes),
+        'b.s': bytes(flowerscript.Assembler.from_records(script(
+            ('val_add', 0x65, 1), ('jmp_be', [0, 0], 0x64, [0, 0], 3, 0)
+        )).bytes),
+    }
+    index = dataflow.build_var_index(archive)
+    fp = io.StringIO()
+    index.save(fp)
+    fp.seek(0)
+    loaded = dataflow.VarIndex.load(fp)
+    assert loaded.addresses == index.addresses
+    assert loaded.scripts == index.scripts
+    # a loaded index is updated like a built one
+    loaded.update('b.s', [])
+    assert loaded.sites(0x65) == [('a.s', 8, 'jmp_le', 2)]
+    assert loaded.scripts == {'a.s': {0x64, 0x65}, 'b.s': set()}
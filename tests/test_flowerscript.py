@@ -0,0 +1,196 @@
+#!/bin/env python3
+import random
+import threading
+
+import pytest
+
+from iglib import batch, flowerscript
+
+
+def text_round_trip(data):
+    # disasm -> Assembler, as python -m iglib dis / asm do
+    text = '\n'.join(flowerscript.disasm(data))
+    return bytes(batch.asm_source(text, flowerscript.ENCODING))
+
+
+def test_op_names_unique():
+    names = [op.opname for op in flowerscript.OPS.values()]
+    assert len(names) == len(set(names))
+    for opcode, op in flowerscript.OPS.items():
+        assert flowerscript.OPS_BYNAME[op.opname][0] == opcode
+
+
+def test_verify_dlg_mode():
+    for data in (b'\x40\x04\x01\x00', b'\xb6\x04\x01\x00'):
+        assert flowerscript.verify(data) == None
+        assert text_round_trip(data) == data
+
+
+def test_tracer_sees_its_thread_only():
+    data = b'\xb6\x04\x01\x00'
+    with flowerscript.Tracer() as tracer:
+        thread = threading.Thread(target=flowerscript.decode, args=(data,))
+        thread.start()
+        thread.join()
+        assert tracer.decoded.counts == {}
+        flowerscript.decode(data)
+    assert tracer.decoded.counts == {0xb6: 1}
+    flowerscript.decode(data)
+    assert tracer.decoded.counts == {0xb6: 1}
+
+
+def le_to(value, size):
+    # the encoder of the original Assembler.op
+    maxval = 1 << (size * 8)
+    if value < 0:
+        value += maxval
+    if value < 0 or not value < maxval:
+        raise ValueError('number out of range')
+    return [(value >> (i * 8)) & 0xFF for i in range(size)]
+
+
+def legacy_op(opname, args, encoding=flowerscript.ENCODING):
+    # the original field by field Assembler.op, OFFSET values as numbers
+    opcode, op = flowerscript.OPS_BYNAME[opname]
+    data = bytearray([opcode, op.opsize])
+    slen_off = slen_siz = None
+    args = list(args)
+    for size, tp in op.fields:
+        if tp == flowerscript.Type.STRLEN:
+            slen_off, slen_siz = len(data), size
+            data.extend(le_to(-1, size))
+        elif tp == flowerscript.Type.BARRAY:
+            array = args.pop(0)
+            if len(array) != size:
+                raise ValueError('data length not equal to definition')
+            data.extend(array)
+        else:
+            data.extend(le_to(args.pop(0), size))
+    if slen_off != None:
+        string = args.pop(0).encode(encoding)
+        data.extend(string)
+        length = len(string)
+        if args:
+            data.extend(args[0])
+            length += len(args[0])
+        data[slen_off:slen_off+slen_siz] = le_to(length, slen_siz)
+    return bytes(data)
+
+
+def new_op(opname, args):
+    s = flowerscript.Assembler()
+    s.op(opname, *args)
+    s.finish()
+    return bytes(s.bytes)
+
+
+def outcome(func, *args):
+    try:
+        return func(*args)
+    except ValueError:
+        return ValueError
+
+
+def field_values(rng, size, tp):
+    Type = flowerscript.Type
+    limit = 1 << (size * 8)
+    if tp == Type.BARRAY:
+        return [bytes(rng.randrange(256) for _ in range(size)),
+                bytes(size + 1), bytes(size - 1)]
+    if tp == Type.OFFSET:
+        return [0, rng.randrange(limit), limit - 1]
+    return [0, 1, -1, limit - 1, -limit, rng.randrange(limit),
+            limit, -limit - 1]
+
+
+# how many of the field_values are in range
+VALID = {
+    flowerscript.Type.BARRAY: 1,
+    flowerscript.Type.OFFSET: 3,
+    flowerscript.Type.HEXNUM: 6,
+    flowerscript.Type.SG_DEC: 6,
+    flowerscript.Type.UN_DEC: 6,
+}
+
+
+def test_op_matches_legacy_encoder():
+    rng = random.Random(0)
+    Type = flowerscript.Type
+    for opcode, op in flowerscript.OPS.items():
+        choices = [
+            field_values(rng, size, tp) for size, tp in op.fields
+            if tp != Type.STRLEN
+        ]
+        strings = [()]
+        if op.slen_index != None:
+            strings = [('',), ('テキスト',), ('text', b'\0\1'),
+                       ('x' * 300,)]
+        for _ in range(60):
+            args = [rng.choice(values) for values in choices]
+            args += rng.choice(strings)
+            expected = outcome(legacy_op, op.opname, args)
+            assert outcome(new_op, op.opname, args) == expected, \
+                (op.opname, args)
+        # every value of every field at least once, the others valid
+        for i, values in enumerate(choices):
+            for value in values:
+                args = [vals[0] for vals in choices]
+                args[i] = value
+                if op.slen_index != None:
+                    args += strings[1]
+                expected = outcome(legacy_op, op.opname, args)
+                assert outcome(new_op, op.opname, args) == expected, \
+                    (op.opname, args)
+
+
+def test_disasm_fast_path_matches_records():
+    # the line templates of disasm against Instruction.format, for every op
+    rng = random.Random(1)
+    Type = flowerscript.Type
+    s = flowerscript.Assembler()
+    for _ in range(5):
+        for opcode, op in flowerscript.OPS.items():
+            # valid values only
+            args = [
+                rng.choice(field_values(rng, size, tp)[:VALID[tp]])
+                for size, tp in op.fields if tp != Type.STRLEN
+            ]
+            if op.slen_index != None:
+                args += rng.choice([('',), ('テキスト',), ('text', b'\0\1')])
+            s.emit(opcode, op, args)
+    s.finish()
+    data = bytes(s.bytes)
+    lines = flowerscript.disasm(data)
+    assert lines == flowerscript.disasm(data, stats=flowerscript.Statistics())
+    assert lines == list(flowerscript.iter_disasm(data))
+    assert text_round_trip(data) == data
+
+
+def test_failed_extend_changes_nothing():
+    s = flowerscript.Assembler()
+    s.op('jmp', 0, s.label_end)
+    s.op('exit', 0)
+    state = (bytes(s.bytes), list(s.lbl_refs), dict(s.lbl_offs),
+             dict(s.labels))
+    records = flowerscript.decode(bytes(s.bytes))
+    for ins in records:
+        ins.offset += 0x100
+    with pytest.raises(ValueError):
+        s.extend(records + [('jmp', 0, 0x104), ('exit', 1 << 16)])
+    assert (bytes(s.bytes), s.lbl_refs, s.lbl_offs, s.labels) == state
+    s.label_end.define()
+    s.finish()
+    assert flowerscript.verify(bytes(s.bytes)) == None
+
+
+def test_string_bytes_exclude_tail():
+    s = flowerscript.Assembler()
+    with flowerscript.Tracer() as tracer:
+        s.op('dlg_str', 0, 'テキスト', b'\0\1')
+        s.extend([('dlg_str', 0, 'text', b'\0\1\2')])
+    stats = flowerscript.Statistics()
+    flowerscript.decode(bytes(s.bytes), stats=stats)
+    opcode = flowerscript.OPS_BYNAME['dlg_str'][0]
+    assert tracer.encoded.string_sizes == {opcode: 8 + 4}
+    assert stats.string_sizes == {opcode: 8 + 4}
+    assert stats.sizes == tracer.encoded.sizes
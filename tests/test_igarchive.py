@@ -0,0 +1,122 @@
+#!/bin/env python3
+import io
+import random
+
+import pytest
+
+from iglib import igarchive
+
+
+def slow_decode_list(data):
+    # reference: one ig_decode call per value
+    values = []
+    offset = 0
+    while offset < len(data):
+        value, offset = igarchive.ig_decode(data, offset)
+        values.append(value)
+    return values
+
+
+def random_values(rng, count):
+    # 1 to 6 encoded bytes per value
+    return [rng.randrange(1 << (7 * rng.randint(1, 6))) for _ in range(count)]
+
+
+def test_encode_list_matches_encode():
+    rng = random.Random(0)
+    for _ in range(200):
+        values = random_values(rng, rng.randint(0, 50))
+        expected = b''.join(igarchive.ig_encode(v) for v in values)
+        assert igarchive.ig_encode_list(values) == expected
+
+
+def test_encode_data_matches_encode():
+    rng = random.Random(1)
+    data = bytes(rng.randrange(256) for _ in range(1000))
+    expected = b''.join(igarchive.ig_encode(v) for v in data)
+    assert igarchive.ig_encode_data(data) == expected
+    assert igarchive.ig_encode_data(list(data)) == expected
+
+
+def test_decode_list_round_trip():
+    rng = random.Random(2)
+    for _ in range(200):
+        values = random_values(rng, rng.randint(0, 50))
+        encoded = igarchive.ig_encode_list(values)
+        assert igarchive.ig_decode_list(encoded) == values
+        assert slow_decode_list(encoded) == values
+
+
+def test_decode_list_offset_end():
+    values = [1, 0x80, 0x3fff, 5]
+    head = igarchive.ig_encode_list([7, 8])
+    encoded = igarchive.ig_encode_list(values)
+    data = b'\xff' + head + encoded + b'\xff'
+    beg = 1 + len(head)
+    assert igarchive.ig_decode_list(data, beg, beg + len(encoded)) == values
+
+
+def test_decode_fast_path_matches_slow_loop():
+    rng = random.Random(3)
+    for _ in range(200):
+        # only single byte values (the translate fast path), or mixed
+        if rng.random() < 0.5:
+            values = [rng.randrange(0x80) for _ in range(rng.randint(0, 50))]
+        else:
+            values = random_values(rng, rng.randint(1, 50))
+        encoded = bytes(igarchive.ig_encode_list(values))
+        assert igarchive.ig_decode_list(encoded) == slow_decode_list(encoded)
+        if all(v < 0x100 for v in values):
+            assert igarchive.ig_decode_data(encoded) == bytearray(values)
+
+
+def test_decode_data_round_trip():
+    rng = random.Random(4)
+    data = bytes(rng.randrange(256) for _ in range(1000))
+    assert igarchive.ig_decode_data(igarchive.ig_encode_data(data)) == data
+
+
+def test_decode_unterminated():
+    with pytest.raises(ValueError):
+        igarchive.ig_decode_list(b'\x02\x04')
+    encoded = igarchive.ig_encode_list([0x4000])
+    with pytest.raises(ValueError):
+        igarchive.ig_decode_list(encoded[:-1])
+
+
+def write_archive(path, files, xor):
+    with open(path, 'wb') as fp:
+        fp.write(igarchive.iga_create(files, xor))
+
+
+@pytest.mark.parametrize('xor', [0x00, 0xFF])
+def test_update_matches_create(tmp_path, xor):
+    rng = random.Random(5)
+    files = [
+        ('%02d.s' % i, bytes(rng.randrange(256) for _ in range(rng.choice(
+            [0, 1, 300, 0x10001]))))
+        for i in range(8)
+    ]
+    old = tmp_path / 'old.iga'
+    write_archive(old, files, xor)
+    replaced = {'01.s': b'new data', '05.s': bytes(0x10003)}
+    added = {'zz.s': b'added', 'aa.s': b''}
+    expected = igarchive.iga_create(
+        [(name, replaced.get(name, data)) for name, data in files]
+        + list(added.items()), xor)
+    with igarchive.IgaArchive(str(old), xor) as arc:
+        # a real file (copy_file_range / sendfile) and a stream
+        with open(tmp_path / 'new.iga', 'wb') as fp:
+            igarchive.iga_update(arc, {**replaced, **added}, fp)
+        stream = io.BytesIO()
+        igarchive.iga_update(arc, {**replaced, **added}, stream)
+        untouched = io.BytesIO()
+        igarchive.iga_update(arc, {}, untouched)
+    assert (tmp_path / 'new.iga').read_bytes() == expected
+    assert stream.getvalue() == expected
+    assert untouched.getvalue() == old.read_bytes()
+    with igarchive.IgaArchive(str(tmp_path / 'new.iga'), xor) as arc:
+        for name, data in files:
+            assert arc.read(name) == replaced.get(name, data)
+        for name, data in added.items():
+            assert arc.read(name) == data
@@ -0,0 +1,91 @@
+#!/bin/env python3
+import io
+import json
+
+import pytest
+
+from iglib import flowerscript, igarchive, manifest
+
+
+def script(*ops):
+    s = flowerscript.Assembler()
+    for op in ops:
+        s.op(*op)
+    s.op('exit', 0)
+    return bytes(s.bytes)
+
+
+@pytest.fixture
+def archive(tmp_path):
+    path = tmp_path / 'script.iga'
+    with open(path, 'wb') as fp:
+        fp.write(igarchive.iga_create([
+            ('start.s', script(
+                ('bg_0f', 0, 'BG01.png'),
+                ('bgm_play', 0, 1, [0, 0, 0], 'Theme'),
+                ('v_play', [0, 0, 0, 0, 0], 'v001'),
+                ('play_video', [0, 0], 1, [0, 0]),
+                ('jmp_script', 0, 'Route.s'),
+            )),
+            ('route.s', script(
+                ('se_play', 0, 0, [0, 0, 0], 'door'),
+                ('fg_12', 0, 'missing.png'),
+                ('bgm_play', 0, 1, [0, 0, 0], 'THEME'),
+                ('play_video', [0, 0], 0, [0, 0]),
+                ('bg_10', 0, ''),
+            )),
+        ], 0xFF))
+    return str(path)
+
+
+def test_script_assets(archive):
+    refs = manifest.script_assets(
+        (archive, 0xFF, 'start.s'), 'cp932', videos={1: 'ed.mpg'})
+    assert [(kind, name, op) for kind, name, _, op in refs] == [
+        ('bg', 'BG01.png', 'bg_0f'),
+        ('bgm', 'Theme.ogg', 'bgm_play'),
+        ('voice', 'v001.ogg', 'v_play'),
+        ('video', 'ed.mpg', 'play_video'),
+        ('script', 'Route.s', 'jmp_script'),
+    ]
+    # unnamed videos are numbered, empty names are not references
+    refs = manifest.script_assets((archive, 0xFF, 'route.s'), 'cp932')
+    assert [(kind, name) for kind, name, _, _ in refs] == [
+        ('se', 'door.ogg'), ('fg', 'missing.png'), ('bgm', 'THEME.ogg'),
+        ('video', '#0'),
+    ]
+
+
+def test_missing_and_orphans(archive):
+    result = manifest.build_manifest(archive, {
+        'bg': ['bg01.PNG', 'bg02.png'],
+        'fg': [],
+        'bgm': ['theme.ogg'],
+        'script': ['start.s', 'route.s'],
+    }, workers=1)
+    # matched case-insensitively, kinds without assets (se, voice, video)
+    # are not checked
+    assert set(result.missing()) == {'fg'}
+    assert list(result.missing()['fg']) == ['missing.png']
+    assert result.orphans() == {'bg': ['bg02.png'], 'script': ['start.s']}
+    assert result.references['bgm'] == {
+        'Theme.ogg': [('start.s', 12, 'bgm_play')],
+        'THEME.ogg': [('route.s', 27, 'bgm_play')],
+    }
+    fp = io.StringIO()
+    result.save(fp)
+    saved = json.loads(fp.getvalue())
+    assert saved['orphans'] == result.orphans()
+    assert saved['missing']['fg']['missing.png'] == [['route.s', 12, 'fg_12']]
+
+
+def test_failed_script(tmp_path):
+    (tmp_path / 'bad.s').write_bytes(b'\xff\x00')
+    (tmp_path / 'good.s').write_bytes(script(('se_play', 0, 0, [0, 0, 0], 'x')))
+    with pytest.raises(ValueError):
+        manifest.build_manifest(str(tmp_path), workers=1)
+    reported = []
+    result = manifest.build_manifest(
+        str(tmp_path), workers=1, report=lambda *res: reported.append(res))
+    assert sorted(name for name, *_ in reported) == ['bad.s', 'good.s']
+    assert result.references == {'se': {'x.ogg': [('good.s', 0, 'se_play')]}}
@@ -0,0 +1,157 @@
+#!/bin/env python3
+import os
+import random
+import struct
+import types
+
+from iglib import flowerscript, igarchive, search, strings
+
+
+def script(*texts):
+    s = flowerscript.Assembler()
+    for text in texts:
+        s.op('dlg_str', 0, text)
+    s.op('exit', 0)
+    return bytes(s.bytes)
+
+
+def replace_archive(path, files):
+    with open(str(path) + '.tmp', 'wb') as fp:
+        fp.write(igarchive.iga_create(files, 0xFF))
+    os.replace(str(path) + '.tmp', path)
+
+
+def found(index, query):
+    return [text for _, _, _, text in index.search(query)]
+
+
+def test_rebuild_after_rewrite(tmp_path):
+    arc, path = str(tmp_path / 'st.iga'), str(tmp_path / 'st.igs')
+    replace_archive(arc, [('a.s', script('あいう'))])
+    with open(os.devnull, 'w') as fp:
+        strings.extract_strings(arc, fp, workers=1)
+    replace_archive(arc, [('a.s', script('かき'))])
+    index, reused, decoded = search.build_search_index(arc, path, workers=1)
+    with index:
+        assert (reused, decoded) == (0, 1)
+        assert found(index, 'あいう') == []
+        assert found(index, 'かき') == ['かき']
+    index, reused, decoded = search.build_search_index(arc, path, workers=1)
+    with index:
+        assert (reused, decoded) == (1, 0)
+        assert found(index, 'かき') == ['かき']
+
+
+WORDS = ['あい', 'うえお', 'いう', 'Ａｂｃ', 'abc', 'Def', '漢字', 'テスト', 'bg01',
+         'x']
+QUERIES = ['あ', 'い', 'あい', 'いう', 'うえお', 'え', 'abc', 'ABC', 'ｂｃ', 'b',
+           'de', '漢', '字', '漢字テ', 'スト', 'bg0', '01', 'あい abc', 'zz',
+           'いうえ']
+
+
+def random_script(rng):
+    s = flowerscript.Assembler()
+    for _ in range(rng.randrange(1, 12)):
+        text = ' '.join(
+            ''.join(rng.choice(WORDS) for _ in range(rng.randrange(1, 4)))
+            for _ in range(rng.randrange(1, 3)))
+        opname = rng.choice(['dlg_str', 'dlg_str', 'bg_0f', 'jmp_script'])
+        s.op(opname, 0, text)
+        s.op('exit', 0)
+    return bytes(s.bytes)
+
+
+def brute_force(files, query, ops=None, script=None):
+    needle = search.normalize(query)
+    return [
+        (name, ins.offset, ins.opcode, ins.string)
+        for name, data in files
+        if script == None or name == script
+        for ins in flowerscript.decode(data)
+        if ins.string != None and needle in search.normalize(ins.string)
+        and (ops == None or ins.op.opname in ops)
+    ]
+
+
+def check(index, files):
+    assert len(index) == len(brute_force(files, ''))
+    for query in QUERIES:
+        assert index.search(query) == brute_force(files, query), query
+    names = [name for name, _ in files]
+    for name in names[:3] + ['missing.s']:
+        for query in QUERIES[:6] + ['']:
+            assert index.search(query, script=name) == \
+                brute_force(files, query, script=name)
+    for ops in (['bg_0f', 'jmp_script'], ['dlg_str'], []):
+        for query in QUERIES[:6]:
+            assert index.search(query, ops) == brute_force(files, query, ops)
+    assert index.resources('bg') == \
+        brute_force(files, 'bg', search.RESOURCE_OPS)
+
+
+def build(tmp_path, files, **kwargs):
+    arc, path = str(tmp_path / 'st.iga'), str(tmp_path / 'st.igs')
+    replace_archive(arc, files)
+    return search.build_search_index(arc, path, workers=1, **kwargs)
+
+
+def test_search_matches_brute_force(tmp_path):
+    rng = random.Random(7)
+    files = [('%02d.s' % i, random_script(rng)) for i in range(12)]
+    index, reused, decoded = build(tmp_path, files)
+    with index:
+        assert (reused, decoded) == (0, 12)
+        check(index, files)
+    # changed, dropped and added scripts, the others are reused with
+    # their site ids moved
+    files[3] = files[3][0], random_script(rng)
+    files[7] = files[7][0], script()
+    del files[0], files[5]
+    files.insert(4, ('new.s', random_script(rng)))
+    files.append(('zz.s', random_script(rng)))
+    index, reused, decoded = build(tmp_path, files)
+    with index:
+        assert (reused, decoded) == (8, 4)
+        check(index, files)
+    index, reused, decoded = build(tmp_path, files)
+    with index:
+        assert (reused, decoded) == (12, 0)
+        check(index, files)
+
+
+def test_mismatch_rebuilds_everything(tmp_path, monkeypatch):
+    files = [('a.s', script('あいう')), ('b.s', script('abc'))]
+    build(tmp_path, files)[0].close()
+    index, reused, decoded = build(tmp_path, files, encoding='gbk')
+    with index:
+        assert (reused, decoded, index.encoding) == (0, 2, 'gbk')
+    monkeypatch.setattr(search, 'VERSION', search.VERSION + 1)
+    index, reused, decoded = build(tmp_path, files, encoding='gbk')
+    with index:
+        assert (reused, decoded) == (0, 2)
+    with open(tmp_path / 'st.igs', 'r+b') as fp:
+        fp.write(b'junk')
+    index, reused, decoded = build(tmp_path, files, encoding='gbk')
+    with index:
+        assert (reused, decoded) == (0, 2)
+
+
+def test_arrays_are_little_endian(tmp_path, monkeypatch):
+    rng = random.Random(3)
+    files = [('%d.s' % i, random_script(rng)) for i in range(4)]
+    index, _, _ = build(tmp_path, files)
+    with index:
+        sites = list(index.sites)
+        results = [index.search(query) for query in QUERIES]
+    with open(tmp_path / 'st.igs', 'rb') as fp:
+        magic, version, size = search.HEADER.unpack(
+            fp.read(search.HEADER.size))
+        fp.seek(search.HEADER.size + size + (-size % 4))
+        data = fp.read(len(sites) * 4)
+    assert list(struct.unpack('<%dI' % len(sites), data)) == sites
+    # the swapped write and read paths of big-endian hosts
+    monkeypatch.setattr(search, 'sys', types.SimpleNamespace(byteorder='big'))
+    os.unlink(tmp_path / 'st.igs')
+    index, _, _ = build(tmp_path, files)
+    with index:
+        assert [index.search(query) for query in QUERIES] == results
@@ -0,0 +1,63 @@
+#!/bin/env python3
+import pytest
+
+from iglib import flowerscript, igarchive, strings
+
+
+def make_script():
+    s = flowerscript.Assembler()
+    s.op('jmp', 0, s.label_end)
+    s.op('dlg_str', 0, 'テキスト')
+    s.op('sel_beg', 0x00)
+    s.op('sel_add', s.label_end, 'choice')
+    s.op('sel_end', 0x64)
+    s.label_end.define()
+    s.op('dlg_str', 0, 'end', b'\0\1')
+    s.op('exit', 0)
+    s.finish()
+    return bytes(s.bytes)
+
+
+@pytest.fixture
+def archive(tmp_path):
+    path = tmp_path / 'script.iga'
+    with open(path, 'wb') as fp:
+        fp.write(igarchive.iga_create(
+            [('a.s', make_script()), ('b.s', make_script())], 0xFF))
+    with igarchive.IgaArchive(str(path), 0xFF) as arc:
+        yield arc
+
+
+def rows(arc):
+    return [
+        row for name in arc
+        for row in strings.script_strings((arc.path, arc.xor, name), 'cp932')
+    ]
+
+
+def test_identical_rows_reproduce_input(archive):
+    changed = strings.inject_strings(archive, rows(archive), workers=1)
+    assert sorted(changed) == ['a.s', 'b.s']
+    for name, data in changed.items():
+        assert data == archive.read(name)
+
+
+def test_longer_string_moves_targets(archive):
+    before = flowerscript.decode(archive.read('a.s'))
+    edited = [
+        row[:3] + (row[3] + 'の続き',) + row[4:] if row[3] == 'テキスト'
+        else row
+        for row in rows(archive) if row[0] == 'a.s'
+    ]
+    changed = strings.inject_strings(archive, edited, workers=1)
+    assert list(changed) == ['a.s']
+    after = flowerscript.decode(changed['a.s'])
+    grown = len('の続き'.encode('cp932'))
+    end = [ins.offset for ins in after if ins.string == 'end'][0]
+    assert end == [ins.offset for ins in before if ins.string == 'end'][0] \
+        + grown
+    # jmp and sel_add both point to the moved instruction
+    assert [ins.targets() for ins in after if ins.targets()] == [[end]] * 2
+    assert [ins.string for ins in after if ins.string != None] == \
+        ['テキストの続き', 'choice', 'end']
+    assert after[-2].tail == b'\0\1'
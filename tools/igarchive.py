@@ -1,71 +1,67 @@
 #!/bin/env python3
-import flowerscript
+import argparse
+import os
+import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from iglib import igarchive  # noqa: E402
 
-def ig_encode(value):
-    if value < 0:
-        raise ValueError('value must be positive')
-    result = bytearray()
-    while True:
-        result.append((value & 0x7F) << 1)
-        value >>= 7
-        if value == 0:
-            break
-    result.reverse()
-    result[-1] |= 0x1
-    return result
 
+def cmd_create(args):
+    files = [(os.path.basename(path), path) for path in args.files]
+    with open(args.archive, 'wb') as fo:
+        igarchive.IgaWriter(fo, args.xor, args.name_encoding).write(files)
 
-def ig_encode_data(data):
-    result = bytearray()
-    for num in data:
-        result += ig_encode(num)
-    return result
 
+def cmd_extract(args):
+    def progress(done_files, total_files, done_bytes, total_bytes):
+        print('\r%d/%d files, %.1f/%.1f MB' % (
+            done_files, total_files,
+            done_bytes / 0x100000, total_bytes / 0x100000,
+        ), end='', file=sys.stderr)
 
-def ig_transform_data(data, xor=0x00):
-    return bytearray(
-        (data[i] ^ (i + 2) ^ xor) & 0xFF
-        for i in range(len(data))
-    )
+    files, size, elapsed = igarchive.iga_extract(
+        args.archive, args.directory, args.xor, args.name_encoding,
+        workers=args.jobs, progress=progress)
+    print(file=sys.stderr)
+    elapsed = max(elapsed, 1e-9)
+    print('%d files, %.1f MB in %.2f s: %.1f MB/s, %.1f files/s' % (
+        files, size / 0x100000, elapsed,
+        size / 0x100000 / elapsed, files / elapsed,
+    ))
 
 
-def iga_create(files, xor=0x00, name_encoding='ascii'):
-    descs = bytearray()
-    names = bytearray()
-    datas = bytearray()
-    fn_beg = 0
-    for name, data in files:
-        name = name.encode(name_encoding)
-        data = ig_transform_data(data, xor)
-        # append to three blocks
-        descs += ig_encode(fn_beg)
-        descs += ig_encode(len(datas))
-        descs += ig_encode(len(data))
-        names += ig_encode_data(name)
-        datas += data
-        # update fn beg
-        fn_beg = fn_beg + len(name)
-    return b''.join((
-        b'IGA0' + b'\0' * 4 + b'\2\0\0\0' * 2,
-        ig_encode(len(descs)), descs,
-        ig_encode(len(names)), names,
-        datas,
-    ))
+def add_options(parser, default):
+    # accepted before and after the command, a subcommand only overrides
+    # the value when given
+    parser.add_argument('--xor', type=lambda x: int(x, 0),
+                        default=0x00 if default else argparse.SUPPRESS,
+                        help='0xFF for script.iga, otherwise 0x00')
+    parser.add_argument('--name-encoding',
+                        default='ascii' if default else argparse.SUPPRESS)
 
 
-filenames = [
-    ('script/start.s', 'start.s'),
-]
+def main():
+    parser = argparse.ArgumentParser(description='IGA archive tool')
+    add_options(parser, True)
+    options = argparse.ArgumentParser(add_help=False)
+    add_options(options, False)
+    commands = parser.add_subparsers(dest='command', required=True)
+    create = commands.add_parser(
+        'create', help='pack files into an archive', parents=[options])
+    create.add_argument('archive')
+    create.add_argument('files', nargs='+')
+    create.set_defaults(func=cmd_create)
+    extract = commands.add_parser(
+        'extract', help='unpack every entry', parents=[options])
+    extract.add_argument('archive')
+    extract.add_argument('directory')
+    extract.add_argument('-j', '--jobs', type=int, default=None,
+                         help='worker processes (default: cpu count)')
+    extract.set_defaults(func=cmd_extract)
+    args = parser.parse_args()
+    args.func(args)
 
-datas = []
-for path, name in filenames:
-    if False:
-        with open(path, 'rb') as fp:
-            print(path)
-            lines = flowerscript.disasm(fp)
-    with open(path, 'rb') as fp:
-        datas.append((name, fp.read()))
 
-with open('script.iga', 'wb') as fo:
-    fo.write(iga_create(datas, 0xFF))
+if __name__ == '__main__':
+    main()